@@ -0,0 +1,200 @@
+"""
+Benchmark suite for mongodb-server.py.
+
+Seeds a scratch database with synthetic sensor messages, and their rollups, at increasing sizes
+and times every route in-process through Flask's test client:
+
+    python benchmark.py                                     # mongomock, 10k messages
+    python benchmark.py --uri mongodb://localhost:27017 --sizes 10k,1m,10m --json results.json
+
+Messages are generated from a fixed seed, so runs against the same backend are comparable.
+"""
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from stats import percentile
+
+BENCHMARK_DATABASE = "iotdata_benchmark"
+SEED_DAYS = 28  # Seeded messages cover the 7 and most of the 30 day analytics windows
+SEED_BATCH_SIZE = 10000
+MONGOMOCK_MAX_SIZE = 100000  # Seeding mongomock slows down with every document, larger datasets need a real mongod
+
+# Sensors of the synthetic messages: (topic, sensor id, payload key)
+SEED_SENSORS = [
+    ("home/security/door/motion", "motion_sensor_1", "motion_detected"),
+    ("home/security/window/motion", "motion_sensor_1", "motion_detected"),
+    ("home/sensors/temperature", "temperature_sensor_1", "temperature"),
+    ("home/security/light", "light_sensor_1", "light_on"),
+    ("home/security/smoke", "smoke_sensor_1", "smoke_detected"),
+]
+
+# Routes timed at every size, as (name, method, path)
+ROUTES = [
+    ("save", "POST", "/save-mqtt-data"),
+    ("motion-data", "GET", "/fetch-motion-data"),
+    ("insights", "GET", "/motion-insights"),
+    ("historical", "GET", "/fetch-historical-data"),
+    ("fetch", "GET", "/fetch-mqtt-data?limit=1000"),
+    ("fetch-topic", "GET", "/fetch-mqtt-data?topic=home/security/door/motion&limit=1000"),
+]
+
+
+def use_mongomock():
+    """
+    Replace pymongo.MongoClient with mongomock's in-memory client, before the server is imported.
+    Also fills the mongomock gaps the server relies on: bulk_write with pymongo 4 operations,
+    Collection.options() and GridFS.
+    """
+    try:
+        import mongomock
+        import mongomock.gridfs
+    except ImportError:
+        raise SystemExit("mongomock is not installed, run `pip install mongomock` or pass --uri")
+    import pymongo
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        for r in requests:
+            if isinstance(r, pymongo.UpdateOne):
+                self.update_one(r._filter, r._doc, upsert=r._upsert)
+            elif isinstance(r, pymongo.ReplaceOne):
+                self.replace_one(r._filter, r._doc, upsert=r._upsert)
+            elif isinstance(r, pymongo.InsertOne):
+                self.insert_one(r._doc)
+
+    mongomock.collection.Collection.bulk_write = bulk_write
+    mongomock.collection.Collection.options = lambda self: {}
+    mongomock.gridfs.enable_gridfs_integration()
+    pymongo.MongoClient = mongomock.MongoClient
+
+
+def parse_size(value):
+    """Parses sizes like 10000, 10k or 1m."""
+    value = value.strip().lower()
+    multiplier = {"k": 1000, "m": 1000000}.get(value[-1:], 1)
+    return int(float(value.rstrip("km")) * multiplier)
+
+
+def synthetic_message(rng, now):
+    """A stored message (see storage.normalize_message) at a random time in the last SEED_DAYS days."""
+    topic, sensor, key = rng.choice(SEED_SENSORS)
+    ts = now - timedelta(seconds=rng.uniform(0, SEED_DAYS * 86400))
+    value = round(rng.uniform(18, 30), 2) if key == "temperature" else rng.random() < 0.3
+    timestamp = (ts - datetime(1970, 1, 1)).total_seconds()
+    return {"topic": topic, "sensor": sensor, "ts": ts, "payload": {"sensor": sensor, key: value, "timestamp": timestamp}}
+
+
+def seed(server, count, target, rng):
+    """Insert messages until `target` are stored, updating the rollups the way the ingest path does."""
+    now = datetime.utcnow()
+    start = time.perf_counter()
+    while count < target:
+        docs = [synthetic_message(rng, now) for _ in range(min(SEED_BATCH_SIZE, target - count))]
+        server.collection.insert_many(docs, ordered=False)
+        server.rollups.update(docs)
+        count += len(docs)
+        print(f"\rSeeded {count}/{target} messages", end="", flush=True)
+    print(f" in {time.perf_counter() - start:.1f}s")
+    return count
+
+
+def save_body(rng):
+    topic, sensor, key = rng.choice(SEED_SENSORS)
+    payload = {"sensor": sensor, key: rng.random() < 0.3, "timestamp": time.time()}
+    return {"topic": topic, "payload": json.dumps(payload)}
+
+
+def time_route(server, test_client, method, path, repeat, rng, cached):
+    """Time `repeat` requests to a route, returns the sorted timings in seconds and the failed request count."""
+    timings = []
+    errors = 0
+    for _ in range(repeat):
+        if not cached:
+            server.response_cache.clear()
+        body = save_body(rng) if method == "POST" else None
+
+        start = time.perf_counter()
+        response = test_client.open(path, method=method, json=body)
+        response.get_data()  # Consume streamed bodies
+        response.close()  # As a WSGI server would, which records the request in /metrics
+        timings.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            errors += 1
+    return sorted(timings), errors
+
+
+def run(server, sizes, repeat, cached, rng):
+    test_client = server.app.test_client()
+    results = []
+    count = server.collection.estimated_document_count()
+    for size in sizes:
+        if count < size:
+            count = seed(server, count, size, rng)
+
+        print(f"{'Route':<14}{'Size':>10}{'p50 (ms)':>11}{'p95 (ms)':>11}{'Max (ms)':>11}{'Errors':>8}")
+        for name, method, path in ROUTES:
+            timings, errors = time_route(server, test_client, method, path, repeat, rng, cached)
+            if method == "POST":
+                # Include writing the buffered messages, which happens after the 202
+                start = time.perf_counter()
+                server.write_buffer.flush()
+                flush = time.perf_counter() - start
+                count += repeat
+            p50, p95 = (percentile(timings, f) * 1000 for f in (0.50, 0.95))
+            print(f"{name:<14}{size:>10}{p50:>11.2f}{p95:>11.2f}{timings[-1] * 1000:>11.2f}{errors:>8}")
+            results.append({"route": name, "method": method, "path": path, "size": size, "repeat": repeat,
+                            "p50_ms": round(p50, 3), "p95_ms": round(p95, 3),
+                            "max_ms": round(timings[-1] * 1000, 3), "errors": errors})
+            if method == "POST":
+                results[-1]["flush_ms"] = round(flush * 1000, 3)
+                print(f"{'  (flush)':<14}{'':>10}{flush * 1000:>11.2f}")
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Seed synthetic data and time every route of mongodb-server.py.")
+    arg_parser.add_argument("--uri", help="MongoDB URI of a local mongod, mongomock is used when omitted")
+    arg_parser.add_argument("--sizes", default="10k",
+                            help="Comma separated dataset sizes, seeded incrementally, e.g. 10k,1m,10m")
+    arg_parser.add_argument("--repeat", type=int, default=20, help="Requests per route and size")
+    arg_parser.add_argument("--cached", action="store_true",
+                            help="Keep the response cache between requests instead of timing every query")
+    arg_parser.add_argument("--seed", type=int, default=42, help="Random seed of the synthetic data")
+    arg_parser.add_argument("--keep", action="store_true",
+                            help=f"Keep the {BENCHMARK_DATABASE} database, later runs continue seeding from it")
+    arg_parser.add_argument("--json", metavar="FILE", help="Also write the results to FILE")
+    arg_parser.add_argument("--metrics", action="store_true", help="Print the /metrics output at the end")
+    args = arg_parser.parse_args()
+
+    sizes = sorted(parse_size(size) for size in args.sizes.split(","))
+    if args.uri:
+        os.environ["DATABASE_URL"] = args.uri
+    else:
+        use_mongomock()
+        if sizes[-1] > MONGOMOCK_MAX_SIZE:
+            raise SystemExit(f"mongomock keeps everything in memory, use --uri for more than {MONGOMOCK_MAX_SIZE} messages")
+
+    # The server connects on import, point it at the scratch database first.
+    # Retention is off there: nothing should expire mid-run, and mongomock scans every document for TTLs on each write.
+    os.environ["DATABASE_NAME"] = BENCHMARK_DATABASE
+    for variable in ("RAW_RETENTION_DAYS", "HOURLY_ROLLUP_RETENTION_DAYS", "DAILY_ROLLUP_RETENTION_DAYS"):
+        os.environ[variable] = "0"
+    from wsgi import server
+
+    try:
+        results = run(server, sizes, args.repeat, args.cached, random.Random(args.seed))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"backend": "mongod" if args.uri else "mongomock", "results": results}, f, indent=2)
+        if args.metrics:
+            print(server.app.test_client().get("/metrics").get_data(as_text=True))
+    finally:
+        server.write_buffer.close()
+        if not args.keep:
+            server.client.drop_database(BENCHMARK_DATABASE)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""
+Gunicorn settings for mongodb-server.py, used as `gunicorn -c gunicorn.conf.py wsgi:app`.
+
+Each worker process runs its own write buffer, response cache and MongoClient pool.
+Requests are handled by threads, so a slow aggregation only occupies one thread
+(pymongo releases the GIL while it waits for MongoDB) while ingest POSTs keep being served.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '5000')}")
+workers = int(os.getenv("GUNICORN_WORKERS", str(min(multiprocessing.cpu_count() * 2 + 1, 8))))
+# gthread holds one thread per open /stream connection, so the server allows at most
+# threads - STREAM_RESERVED_THREADS streams per worker; for many live dashboards use "gevent"
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "8"))  # Keep MONGO_MAX_POOL_SIZE at least this large
+# Tells the app whether a single process sees every write (see live_feed_complete() in mongodb-server.py)
+# and, under gthread, how many threads /stream clients may take (see STREAM_MAX_CLIENTS)
+raw_env = [f"SERVER_WORKERS={workers}"]
+if worker_class == "gthread":
+    raw_env.append(f"SERVER_THREADS={threads}")
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))  # Seconds before a stuck worker is restarted
+graceful_timeout = 30  # Time for workers to flush their write buffers on shutdown
+keepalive = 5
+
+# MongoClient is not fork-safe, so the app is imported in every worker after the fork
+preload_app = False
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG")  # e.g. "-" for stdout, off by default
+errorlog = "-"
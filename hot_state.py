@@ -0,0 +1,187 @@
+from collections import deque
+from statistics import fmean, pstdev
+import threading
+import time
+from wire_format import SENSOR_TYPES
+
+# Payload keys holding a sensor's value, see wire_format.SENSOR_TYPES
+VALUE_KEYS = tuple(key for key, _ in SENSOR_TYPES.values())
+
+
+class SensorState:
+    """The latest value of one topic and a ring buffer of its recent (ts, value) readings."""
+
+    __slots__ = ("topic", "sensor", "key", "value", "ts", "history")
+
+    def __init__(self, topic, sensor, key, history_size):
+        self.topic = topic
+        self.sensor = sensor
+        self.key = key
+        self.value = None
+        self.ts = None
+        self.history = deque(maxlen=history_size)
+
+    def to_dict(self, history=False):
+        state = {"sensor": self.sensor, "key": self.key, "value": self.value, "ts": self.ts}
+        if history:
+            state["history"] = list(self.history)
+        return state
+
+
+def reading_of(doc):
+    """Returns the (payload key, value) of a stored message, or None for messages without a sensor value."""
+    payload = doc.get("payload")
+    if isinstance(payload, dict):
+        for key in VALUE_KEYS:
+            if key in payload:
+                return key, payload[key]
+    return None
+
+
+class HotStateStore:
+    """
+    In-memory latest-value store, fed with messages as they are ingested.
+    Readings older than the current state of their topic are ignored, so feeding the
+    same message twice (e.g. from ingest and a change stream) has no effect.
+    """
+
+    def __init__(self, history_size=60):
+        self.history_size = history_size
+        self._states = {}  # SensorState by topic
+        self._lock = threading.Lock()
+
+    def update(self, docs):
+        """
+        Apply stored messages, returns (state, previous value) for each reading that changed the state.
+        The previous value is None for the first reading of a topic.
+        """
+        applied = []
+        with self._lock:
+            for doc in docs:
+                reading = reading_of(doc)
+                if reading is None:
+                    continue
+                key, value = reading
+                state = self._states.get(doc["topic"])
+                if state is None:
+                    state = self._states[doc["topic"]] = SensorState(doc["topic"], doc.get("sensor"), key, self.history_size)
+                elif state.ts is not None and doc["ts"] <= state.ts:
+                    continue  # Out of order or already applied
+
+                previous = state.value
+                state.sensor = doc.get("sensor")
+                state.key = key
+                state.value = value
+                state.ts = doc["ts"]
+                state.history.append((doc["ts"], value))
+                applied.append((state, previous))
+        return applied
+
+    def current(self, history=False):
+        """The state of every topic, as JSON-ready dicts keyed by topic."""
+        with self._lock:
+            return {topic: state.to_dict(history) for topic, state in self._states.items()}
+
+
+class AnomalyDetector:
+    """
+    Streaming rules evaluated on every state change, without database queries:
+    smoke detected, motion at an hour that rarely sees motion according to the hourly
+    profile of the rollups, and temperature readings far from their recent average.
+    The same alert type is raised at most once per topic every `cooldown` seconds.
+    """
+
+    def __init__(self, unusual_motion_share=0.01, motion_profile_min_events=50,
+                 temperature_spike_degrees=3.0, temperature_spike_sigma=3.0, temperature_min_samples=10,
+                 cooldown=300, max_alerts=1000):
+        self.unusual_motion_share = unusual_motion_share
+        self.motion_profile_min_events = motion_profile_min_events
+        self.temperature_spike_degrees = temperature_spike_degrees
+        self.temperature_spike_sigma = temperature_spike_sigma
+        self.temperature_min_samples = temperature_min_samples
+        self.cooldown = cooldown
+
+        self.motion_profile = {}  # Motion hits per UTC hour (24 counts) by topic
+        self.alerts = deque(maxlen=max_alerts)  # Most recent last
+        self._last_raised = {}  # Monotonic time by (alert type, topic)
+        self._lock = threading.Lock()
+
+    def set_motion_profile(self, profile):
+        self.motion_profile = profile
+
+    def check(self, applied):
+        """Evaluate the rules for the output of HotStateStore.update(), returns the raised alerts."""
+        raised = []
+        for state, previous in applied:
+            if state.key == "smoke_detected":
+                alert = self.check_smoke(state, previous)
+            elif state.key == "motion_detected":
+                alert = self.check_motion(state, previous)
+            elif state.key == "temperature":
+                alert = self.check_temperature(state)
+            else:
+                alert = None
+            if alert is not None and self._should_raise(alert):
+                raised.append(alert)
+
+        if raised:
+            with self._lock:
+                self.alerts.extend(raised)
+        return raised
+
+    def check_smoke(self, state, previous):
+        if state.value is True and previous is not True:
+            return self._alert("smoke", "critical", state, "Smoke detected")
+        return None
+
+    def check_motion(self, state, previous):
+        if state.value is not True or previous is True:
+            return None
+        hourly = self.motion_profile.get(state.topic)
+        total = sum(hourly) if hourly else 0
+        if total < self.motion_profile_min_events:
+            return None  # Not enough history to tell what is unusual
+        share = hourly[state.ts.hour] / total
+        if share < self.unusual_motion_share:
+            message = f"Motion at {state.ts.hour}:00 UTC, an hour with {share:.1%} of the usual motion"
+            return self._alert("unusual_motion", "warning", state, message)
+        return None
+
+    def check_temperature(self, state):
+        # Compare with the readings before this one
+        previous = [value for _, value in list(state.history)[:-1] if isinstance(value, (int, float))]
+        if len(previous) < self.temperature_min_samples or not isinstance(state.value, (int, float)):
+            return None
+        mean = fmean(previous)
+        threshold = max(self.temperature_spike_degrees, self.temperature_spike_sigma * pstdev(previous, mean))
+        if abs(state.value - mean) > threshold:
+            message = f"Temperature {state.value} deviates {state.value - mean:+.1f} degrees from the recent average {mean:.1f}"
+            return self._alert("temperature_spike", "warning", state, message)
+        return None
+
+    def recent(self, limit=100):
+        """The most recent alerts, newest first."""
+        with self._lock:
+            return list(self.alerts)[-limit:][::-1]
+
+    def _alert(self, alert_type, severity, state, message):
+        return {
+            "type": alert_type,
+            "severity": severity,
+            "topic": state.topic,
+            "sensor": state.sensor,
+            "value": state.value,
+            "ts": state.ts,
+            "raised_at": time.time(),
+            "message": message,
+        }
+
+    def _should_raise(self, alert):
+        key = (alert["type"], alert["topic"])
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_raised.get(key)
+            if last is not None and now - last < self.cooldown:
+                return False
+            self._last_raised[key] = now
+            return True
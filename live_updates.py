@@ -0,0 +1,123 @@
+from collections import deque
+import json
+import threading
+
+
+def format_event(event, data, default=None):
+    """Encode one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data, default=default, separators=(',', ':'))}\n\n".encode("utf-8")
+
+
+class Subscription:
+    """
+    The queue of encoded events waiting to be sent to one client.
+    A client that falls more than `max_queue` events behind is closed instead of
+    buffering without bound; it reconnects and starts again from a fresh snapshot.
+    """
+
+    def __init__(self, max_queue):
+        self.max_queue = max_queue
+        self.closed = False
+        self._events = deque()
+        self._cond = threading.Condition()
+
+    def put(self, event):
+        """Queue an encoded event, returns False if the subscription is (now) closed."""
+        with self._cond:
+            if self.closed:
+                return False
+            if len(self._events) >= self.max_queue:
+                self.closed = True
+                self._events.clear()
+                self._cond.notify()
+                return False
+            self._events.append(event)
+            self._cond.notify()
+            return True
+
+    def get(self, timeout):
+        """Return the next event, or None after `timeout` seconds or once closed."""
+        with self._cond:
+            if not self._events and not self.closed:
+                self._cond.wait(timeout)
+            if self._events:
+                return self._events.popleft()
+            return None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+class Broadcaster:
+    """
+    Fans out events to every connected client from memory.
+    Each event is encoded once, whatever the number of clients, and the latest
+    reading of every topic is kept so new clients start with the current state.
+    """
+
+    def __init__(self, max_clients=1000, max_queue=256, json_default=None):
+        self.max_clients = max_clients
+        self.max_queue = max_queue
+        self.json_default = json_default
+
+        self._subscriptions = set()
+        self._latest = {}  # Latest reading by topic
+        self._lock = threading.Lock()
+
+        # Counters exposed through stats()
+        self.events = 0
+        self.dropped_clients = 0
+        self.rejected_clients = 0
+
+    def subscribe(self):
+        """Register a client and return its Subscription, or None when max_clients are connected."""
+        with self._lock:
+            if len(self._subscriptions) >= self.max_clients:
+                self.rejected_clients += 1
+                return None
+            subscription = Subscription(self.max_queue)
+            self._subscriptions.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event, data):
+        """Send an event to every client, dropping the clients that cannot keep up."""
+        message = format_event(event, data, self.json_default)
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+            self.events += 1
+
+        dropped = [subscription for subscription in subscriptions if not subscription.put(message)]
+        if dropped:
+            with self._lock:
+                self._subscriptions.difference_update(dropped)
+                self.dropped_clients += len(dropped)
+
+    def update_state(self, readings):
+        """Remember the latest reading per topic and send the readings as a "state" event."""
+        with self._lock:
+            for reading in readings:
+                self._latest[reading["topic"]] = reading
+        self.publish("state", readings)
+
+    def snapshot(self):
+        """The encoded "state" event with the latest reading of every topic."""
+        with self._lock:
+            readings = list(self._latest.values())
+        return format_event("state", readings, self.json_default)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._subscriptions),
+                "topics": len(self._latest),
+                "events": self.events,
+                "dropped_clients": self.dropped_clients,
+                "rejected_clients": self.rejected_clients,
+            }
@@ -0,0 +1,156 @@
+"""
+Mixed-traffic load test for mongodb-server.py, using only the standard library.
+
+Worker threads send a mix of bulk ingest POSTs and analytics GETs for a fixed duration,
+then the requests/sec and latency percentiles are printed per request type:
+
+    python loadtest.py --url http://localhost:5000 --concurrency 32 --duration 30
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+from stats import percentile
+
+ANALYTICS_PATHS = [
+    "/fetch-motion-data",
+    "/motion-insights",
+    "/fetch-historical-data",
+    "/fetch-mqtt-data?limit=100",
+]
+INGEST_PATH = "/save-mqtt-data/bulk"
+INGEST_TOPICS = [
+    ("home/security/door/motion", "motion_sensor_1", "motion_detected"),
+    ("home/security/window/motion", "motion_sensor_1", "motion_detected"),
+    ("home/security/light", "light_sensor_1", "light_on"),
+    ("home/security/smoke", "smoke_sensor_1", "smoke_detected"),
+]
+REQUEST_TIMEOUT = 30  # Seconds
+
+
+def ingest_body(batch_size):
+    """A bulk ingest request body in the shape the dashboard sends."""
+    now = time.time()
+    messages = []
+    for _ in range(batch_size):
+        topic, sensor, key = random.choice(INGEST_TOPICS)
+        payload = {"sensor": sensor, key: random.choice([True, False]), "timestamp": now}
+        messages.append({"topic": topic, "payload": json.dumps(payload)})
+    return json.dumps(messages).encode("utf-8")
+
+
+class LoadTest:
+    """Runs the request mix from `concurrency` threads, each with its own keep-alive connection."""
+
+    def __init__(self, url, concurrency, duration, ingest_ratio, batch_size, cache_bust=False):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.concurrency = concurrency
+        self.duration = duration
+        self.ingest_ratio = ingest_ratio
+        self.batch_size = batch_size
+        self.cache_bust = cache_bust
+
+        self._lock = threading.Lock()
+        self.latencies = {"ingest": [], "analytics": []}  # Seconds, by request type
+        self.status_counts = {"ingest": {}, "analytics": {}}
+        self.errors = {"ingest": 0, "analytics": 0}
+
+    def request(self, connection, kind):
+        if kind == "ingest":
+            method, path, body = "POST", INGEST_PATH, ingest_body(self.batch_size)
+            headers = {"Content-Type": "application/json"}
+        else:
+            method, path, body, headers = "GET", random.choice(ANALYTICS_PATHS), None, {}
+            if self.cache_bust:
+                # A distinct query string misses the server's response cache
+                separator = "&" if "?" in path else "?"
+                path = f"{path}{separator}nocache={random.getrandbits(64)}"
+
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+
+    def run_worker(self, end):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=REQUEST_TIMEOUT)
+        latencies = {"ingest": [], "analytics": []}
+        statuses = {"ingest": {}, "analytics": {}}
+        errors = {"ingest": 0, "analytics": 0}
+
+        while time.perf_counter() < end:
+            kind = "ingest" if random.random() < self.ingest_ratio else "analytics"
+            start = time.perf_counter()
+            try:
+                status = self.request(connection, kind)
+            except (OSError, http.client.HTTPException):
+                errors[kind] += 1
+                connection.close()  # Reconnects on the next request
+                continue
+            latencies[kind].append(time.perf_counter() - start)
+            statuses[kind][status] = statuses[kind].get(status, 0) + 1
+        connection.close()
+
+        with self._lock:
+            for kind in latencies:
+                self.latencies[kind].extend(latencies[kind])
+                self.errors[kind] += errors[kind]
+                for status, count in statuses[kind].items():
+                    self.status_counts[kind][status] = self.status_counts[kind].get(status, 0) + count
+
+    def run(self):
+        print(f"Load testing {self.host}:{self.port} with {self.concurrency} connections for {self.duration}s, "
+              f"{self.ingest_ratio:.0%} ingest ({self.batch_size} messages per request)")
+        start = time.perf_counter()
+        end = start + self.duration
+        threads = [threading.Thread(target=self.run_worker, args=(end,)) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    def report(self, elapsed):
+        print(f"{'Type':<11}{'Requests':>10}{'Req/s':>10}{'p50 (ms)':>11}{'p95 (ms)':>11}{'p99 (ms)':>11}"
+              f"{'Max (ms)':>11}{'Errors':>8}  Statuses")
+        all_latencies = []
+        for kind, latencies in self.latencies.items():
+            all_latencies.extend(latencies)
+            self.print_row(kind, sorted(latencies), elapsed, self.errors[kind], self.status_counts[kind])
+        self.print_row("total", sorted(all_latencies), elapsed, sum(self.errors.values()), {})
+
+    @staticmethod
+    def print_row(name, latencies, elapsed, errors, statuses):
+        if latencies:
+            p50, p95, p99 = (percentile(latencies, f) * 1000 for f in (0.50, 0.95, 0.99))
+            timings = f"{p50:>11.1f}{p95:>11.1f}{p99:>11.1f}{latencies[-1] * 1000:>11.1f}"
+        else:
+            timings = f"{'-':>11}" * 4
+        status_text = ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items()))
+        print(f"{name:<11}{len(latencies):>10}{len(latencies) / elapsed:>10.1f}{timings}{errors:>8}  {status_text}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Load test mongodb-server.py with mixed ingest and analytics traffic.")
+    arg_parser.add_argument("--url", default="http://localhost:5000", help="Base URL of the server")
+    arg_parser.add_argument("--concurrency", type=int, default=16, help="Concurrent connections")
+    arg_parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    arg_parser.add_argument("--ingest-ratio", type=float, default=0.8,
+                            help="Fraction of requests that are bulk ingest POSTs, the rest are analytics GETs")
+    arg_parser.add_argument("--batch-size", type=int, default=50, help="Messages per bulk ingest request")
+    arg_parser.add_argument("--cache-bust", action="store_true",
+                            help="Add a random query parameter to analytics requests so they miss the response cache")
+    args = arg_parser.parse_args()
+
+    test = LoadTest(args.url, args.concurrency, args.duration, args.ingest_ratio, args.batch_size, args.cache_bust)
+    elapsed = test.run()
+    test.report(elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Prometheus-style metrics for mongodb-server.py, rendered in the text exposition format
+without depending on a client library.
+"""
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+import os
+import threading
+
+# Latency buckets in seconds, from a cached response to a slow aggregation
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """A monotonically increasing value per label combination."""
+
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self, extra=()):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, key, extra)} {value}"
+
+
+class Histogram:
+    """Observations counted into cumulative buckets per label combination, with their sum and count."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # Label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self, extra=()):
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        extra = list(extra)
+        for key, state in sorted(values.items()):
+            for bound, count in zip(self.buckets, state):
+                yield f"{self.name}_bucket{format_labels(self.labelnames, key, extra + [('le', bound)])} {count}"
+            yield f"{self.name}_bucket{format_labels(self.labelnames, key, extra + [('le', '+Inf')])} {state[-1]}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, key, extra)} {state[-2]}"
+            yield f"{self.name}_count{format_labels(self.labelnames, key, extra)} {state[-1]}"
+
+
+class Registry:
+    """
+    The metrics exposed at /metrics.
+    Collectors are called on every render and return (name, type, help, samples) tuples,
+    for values that are read at scrape time instead of being tracked.
+    Tracked metrics only cover this process, so their samples carry a `worker` label with its pid.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        # Read at render time, the registry may have been created before the worker was forked
+        worker = [("worker", os.getpid())]
+        families = [(m.name, m.type, m.help, m.samples(worker)) for m in self._metrics]
+        for collector in self._collectors:
+            families.extend(collector())
+
+        lines = []
+        for name, metric_type, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """
+    Records the duration of every MongoDB command and the documents it returned,
+    labelled with the command name and the route that issued it.
+    `route_of` returns the current route, e.g. "background" outside of a request.
+    Commands are only observed with a real server, mongomock does not emit command events.
+    """
+
+    def __init__(self, registry, route_of=lambda: ""):
+        self.route_of = route_of
+        self.seconds = registry.histogram(
+            "mongodb_command_duration_seconds", "Time spent in MongoDB commands.", ["command", "route"])
+        self.returned = registry.counter(
+            "mongodb_command_returned_documents_total", "Documents returned to the server by MongoDB commands.",
+            ["command", "route"])
+        self.failures = registry.counter(
+            "mongodb_command_failures_total", "MongoDB commands that failed.", ["command", "route"])
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        route = self.route_of()
+        self.seconds.observe(event.duration_micros / 1e6, command=event.command_name, route=route)
+        cursor = event.reply.get("cursor") if isinstance(event.reply, dict) else None
+        if isinstance(cursor, dict):
+            batch = cursor.get("firstBatch", cursor.get("nextBatch", []))
+            self.returned.inc(len(batch), command=event.command_name, route=route)
+
+    def failed(self, event):
+        route = self.route_of()
+        self.seconds.observe(event.duration_micros / 1e6, command=event.command_name, route=route)
+        self.failures.inc(command=event.command_name, route=route)
+
+
+# serverStatus counters: metric name -> (path in the serverStatus reply, help)
+SERVER_STATUS_COUNTERS = {
+    "mongodb_scanned_keys_total": (("metrics", "queryExecutor", "scanned"), "Index keys scanned by queries, server wide."),
+    "mongodb_scanned_documents_total": (("metrics", "queryExecutor", "scannedObjects"), "Documents scanned by queries, server wide."),
+    "mongodb_returned_documents_total": (("metrics", "document", "returned"), "Documents returned by queries, server wide."),
+    "mongodb_inserted_documents_total": (("metrics", "document", "inserted"), "Documents inserted, server wide."),
+}
+
+
+def server_status_collector(db):
+    """
+    Collector reading the documents scanned versus returned from serverStatus.
+    A scanned/returned ratio well above 1 means queries are not served by an index.
+    Needs the clusterMonitor role; nothing is reported when serverStatus is unavailable.
+    """
+    def collect():
+        try:
+            status = db.command("serverStatus")
+        except (PyMongoError, NotImplementedError):
+            return []
+
+        families = []
+        for name, (path, help) in SERVER_STATUS_COUNTERS.items():
+            value = status
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            if value is not None:
+                families.append((name, "counter", help, [f"{name} {int(value)}"]))
+        return families
+    return collect
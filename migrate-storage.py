@@ -0,0 +1,136 @@
+from pymongo import MongoClient, UpdateOne
+from datetime import datetime, timedelta
+import argparse
+import os
+import statistics
+import time
+from storage import DATABASE_NAME, COLLECTION_NAME, MOTION_TOPIC, normalize_message, ensure_indexes, ensure_ttl_index, is_timeseries, motion_pipeline, Rollups, ImageStore
+
+# MongoDB Configuration
+MONGO_URI = os.getenv("DATABASE_URL")
+
+# Matches motion detections in legacy documents, where the payload is a JSON string
+LEGACY_MOTION_DETECTED = {"$regexMatch": {"input": "$payload", "regex": r'"motion_detected"\s*:\s*true'}}
+
+
+def legacy_pipeline(start_date, end_date, group):
+    """Analytics pipeline over the legacy schema (ISO string timestamps, JSON string payloads)."""
+    return [
+        {
+            "$match": {
+                "topic": MOTION_TOPIC,
+                "timestamp": {"$gte": start_date.isoformat(), "$lte": end_date.isoformat()},
+                "$expr": LEGACY_MOTION_DETECTED
+            }
+        },
+        {"$project": {"_id": 0, "ts": {"$toDate": "$timestamp"}}},
+        {"$group": group}
+    ]
+
+
+def analytics_queries(build_pipeline, now):
+    """The queries behind each analytics endpoint, built with the given pipeline builder."""
+    day = {"$dateToString": {"format": "%Y-%m-%d", "date": "$ts"}}
+    hour = {"$hour": "$ts"}
+    return {
+        "/fetch-motion-data": build_pipeline(now - timedelta(days=7), now, {"_id": {"day": day, "hour": hour}}),
+        "/motion-insights": build_pipeline(now - timedelta(days=30), now, {"_id": {"day": day, "hour": hour}, "count": {"$sum": 1}}),
+        "/fetch-historical-data": build_pipeline(now - timedelta(days=90), now, {"_id": day, "total_motions": {"$sum": 1}}),
+    }
+
+
+def measure(collection, queries, repeat):
+    """Run each query `repeat` times and return the median time in milliseconds."""
+    timings = {}
+    for endpoint, pipeline in queries.items():
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(collection.aggregate(pipeline))
+            samples.append((time.perf_counter() - start) * 1000)
+        timings[endpoint] = statistics.median(samples)
+    return timings
+
+
+def migrate(collection, batch_size, images=None):
+    """
+    Convert legacy documents to the typed schema in place.
+    Inline base64 camera frames are moved to the ImageStore `images`.
+    Documents are processed in _id order, so an interrupted migration can simply be re-run.
+    Returns the number of migrated and skipped documents.
+    """
+    migrated = skipped = 0
+    last_id = None
+    while True:
+        query = {"ts": {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(collection.find(query).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+
+        updates = []
+        for doc in batch:
+            try:
+                typed = normalize_message(doc.get("topic"), doc.get("payload"), doc.get("timestamp"), images=images)
+            except (TypeError, ValueError, OverflowError) as e:
+                print(f"Skipping document {doc['_id']}: {e}")
+                skipped += 1
+                continue
+            updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": typed, "$unset": {"timestamp": ""}}))
+
+        if updates:
+            collection.bulk_write(updates, ordered=False)
+            migrated += len(updates)
+        print(f"Migrated {migrated} documents...")
+    return migrated, skipped
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Migrate mqttMessages to the typed storage schema.")
+    arg_parser.add_argument("--batch-size", type=int, default=1000, help="Documents per bulk update")
+    arg_parser.add_argument("--measure", action="store_true",
+                            help="Time the analytics queries before and after the migration")
+    arg_parser.add_argument("--rebuild-rollups", action="store_true",
+                            help="Recompute the hourly and daily rollups from the migrated messages, "
+                                 "always done when documents were migrated")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="Runs per query when measuring")
+    args = arg_parser.parse_args()
+
+    client = MongoClient(MONGO_URI)
+    db = client[DATABASE_NAME]
+    collection = db[COLLECTION_NAME]
+    now = datetime.utcnow()
+
+    # Time-series collections are always created with the typed schema
+    if is_timeseries(collection):
+        print("mqttMessages is a time-series collection, there is nothing to migrate")
+        return
+
+    if args.measure:
+        before = measure(collection, analytics_queries(legacy_pipeline, now), args.repeat)
+
+    # Order matters: migrated documents get a `ts` and expire through the raw TTL index,
+    # so the index is dropped until the rollups hold their statistics
+    ensure_ttl_index(collection, "ts", 0, "ts_ttl")
+    migrated, skipped = migrate(collection, args.batch_size, ImageStore(db))
+    print(f"Done: {migrated} documents migrated, {skipped} skipped")
+
+    if args.rebuild_rollups or migrated:  # The analytics endpoints only read the rollups
+        rollups = Rollups(db)
+        rollups.ensure_indexes()
+        rollups.rebuild(collection)
+        print("Rollups rebuilt")
+
+    ensure_indexes(collection)  # Restores the raw TTL index
+
+    if args.measure:
+        after = measure(collection, analytics_queries(motion_pipeline, now), args.repeat)
+        print(f"{'Endpoint':<25}{'Before (ms)':>15}{'After (ms)':>15}")
+        for endpoint in before:
+            print(f"{endpoint:<25}{before[endpoint]:>15.1f}{after[endpoint]:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
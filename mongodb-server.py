@@ -1,118 +1,610 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context, g, has_request_context
 from flask_cors import CORS
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
+from pymongo.errors import PyMongoError
+from bson import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime, timedelta
+import base64
+import binascii
 import json
-from dateutil import parser
-import pytz
+import re
+import struct
+import threading
+import time
 from dotenv import load_dotenv
+import atexit
+import functools
 import os
+from write_buffer import WriteBuffer
+from response_cache import ResponseCache
+from live_updates import Broadcaster
+from hot_state import HotStateStore, AnomalyDetector
+from metrics import Registry, CommandMetrics, server_status_collector
+from wire_format import COMPACT_CONTENT_TYPE, decode_payload
+from storage import DATABASE_NAME, MOTION_TOPIC, get_collection, parse_timestamp, normalize_message, normalize_image, ensure_indexes, is_timeseries, hour_bucket, day_bucket, rollup_deltas, run_image_expiry, Rollups, ImageStore
+
+# Metrics Configuration
+# Prometheus-style metrics exposed at /metrics, see metrics.py
+metrics = Registry()
+request_latency = metrics.histogram(
+    "http_request_duration_seconds", "Time to serve a request, including streaming the body.",
+    ["method", "route", "status"])
+METRICS_EXCLUDED_ROUTES = {"/stream", "/metrics"}  # Long-lived streams and scrapes would skew the histograms
+
+
+def current_route():
+    """The route template of the request being handled, used as a metric label."""
+    if not has_request_context():
+        return "background"  # Write buffer flushes, change stream
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+monitoring.register(CommandMetrics(metrics, route_of=current_route))  # Must happen before the MongoClient is created
 
 # MongoDB Configuration
 # Load URI from .env
 MONGO_URI = os.getenv("DATABASE_URL")
-client = MongoClient(MONGO_URI)
-db = client["iotdata"]  # Database name
-collection = db["mqttMessages"]  # Collection name
+# Connection pool, per server process. Every request thread holds a connection while it
+# queries, so MONGO_MAX_POOL_SIZE should be at least the number of threads per worker.
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))  # Connections kept open while idle
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))  # Fail instead of queueing forever
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+client = MongoClient(
+    MONGO_URI,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+)
+db = client[DATABASE_NAME]  # Database name
+metrics.add_collector(server_status_collector(db))  # Documents scanned versus returned
+collection = get_collection(db)  # Collection name: mqttMessages
+ensure_indexes(collection)  # {topic, ts} and {sensor, ts} compound indexes
+TIMESERIES = is_timeseries(collection)  # Time-series collections have no _id index
+rollups = Rollups(db)  # Hourly and daily statistics, updated on every write
+rollups.ensure_indexes()
+images = ImageStore(db)  # Camera frames, stored once per distinct image
+
+# Write Buffer Configuration
+# Incoming messages are buffered in memory and written in batches
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "0.5"))  # Seconds
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "50000"))
+INGEST_HIGH_WATER_MARK = 0.8  # Saturation at which callers are asked to slow down
+
+# Response Cache Configuration
+# Analytics responses are cached until new data arrives for their topic or the TTL expires
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))  # Seconds
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
+response_cache = ResponseCache(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES)
+
+# Live Update Configuration
+# /stream clients get the latest readings and hourly rollup deltas pushed as Server-Sent Events
+# Each stream holds a request thread while it is open. Under gthread, gunicorn.conf.py passes the threads
+# per worker as SERVER_THREADS, and the default cap keeps STREAM_RESERVED_THREADS of them free for ingest
+# and analytics requests. The development server and async workers (gevent) do not run out of threads
+SERVER_THREADS = int(os.getenv("SERVER_THREADS", "0"))  # 0 when threads are not limited
+STREAM_RESERVED_THREADS = int(os.getenv("STREAM_RESERVED_THREADS", "4"))
+STREAM_MAX_CLIENTS = int(os.getenv(
+    "STREAM_MAX_CLIENTS",
+    str(max(SERVER_THREADS - STREAM_RESERVED_THREADS, 1)) if SERVER_THREADS else "1000"))  # Per server process
+STREAM_MAX_QUEUE = int(os.getenv("STREAM_MAX_QUEUE", "256"))  # Events a client may fall behind before it is dropped
+STREAM_KEEPALIVE = 15  # Seconds between keep-alive comments on an idle stream
+# Follow inserts through a MongoDB change stream (replica set only) instead of this process's writes,
+# so writes by mqtt-ingest.py and other server workers reach the stream as well
+STREAM_CHANGE_STREAM = os.getenv("STREAM_CHANGE_STREAM", "0").lower() in ("1", "true", "yes")
+
+broadcaster = Broadcaster(max_clients=STREAM_MAX_CLIENTS, max_queue=STREAM_MAX_QUEUE,
+                          json_default=lambda value: to_json_value(value))
+
+# Hot State Configuration
+# Latest value and recent readings of every topic in memory, checked by streaming alert rules (see hot_state.py).
+# Each server process keeps its own. It is only complete if the process sees every stored message,
+# see live_feed_complete()
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))  # Server processes, set by gunicorn.conf.py
+HOT_STATE_HISTORY = int(os.getenv("HOT_STATE_HISTORY", "60"))  # Readings kept per topic
+MOTION_PROFILE_DAYS = 30  # Hourly motion profile window, the same as /motion-insights
+MOTION_PROFILE_REFRESH = 3600  # Seconds between reloads of the profile from the rollups
+UNUSUAL_MOTION_SHARE = float(os.getenv("UNUSUAL_MOTION_SHARE", "0.01"))  # Hours with less of the motion are unusual
+TEMPERATURE_SPIKE_DEGREES = float(os.getenv("TEMPERATURE_SPIKE_DEGREES", "3.0"))  # Minimum deviation from the recent average
+ALERT_COOLDOWN = float(os.getenv("ALERT_COOLDOWN", "300"))  # Seconds before the same alert is raised again for a topic
+
+hot_state = HotStateStore(history_size=HOT_STATE_HISTORY)
+anomalies = AnomalyDetector(
+    unusual_motion_share=UNUSUAL_MOTION_SHARE,
+    temperature_spike_degrees=TEMPERATURE_SPIKE_DEGREES,
+    cooldown=ALERT_COOLDOWN,
+)
+
+
+def on_flush(docs):
+    """Called by the write buffer after each written batch."""
+    rollups.update(docs)
+    response_cache.invalidate({doc["topic"] for doc in docs})
+    if not STREAM_CHANGE_STREAM:
+        publish_live(docs)
+
+
+write_buffer = WriteBuffer(
+    collection,
+    max_batch_size=INGEST_BATCH_SIZE,
+    max_age=INGEST_FLUSH_INTERVAL,
+    max_pending=INGEST_MAX_PENDING,
+    on_flush=on_flush,
+)
+atexit.register(write_buffer.close)
 
 # Flask App Configuration
 app = Flask(__name__)
 CORS(app)  # Enable Cross-Origin Resource Sharing
 
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    route = current_route()
+    started = getattr(g, "request_started", None)
+    if started is not None and route not in METRICS_EXCLUDED_ROUTES:
+        labels = {"method": request.method, "route": route, "status": str(response.status_code)}
+        # Observed once the body has been sent, so streamed responses are timed in full
+        response.call_on_close(lambda: request_latency.observe(time.perf_counter() - started, **labels))
+    return response
+
+def cached(*topics):
+    """
+    Cache a GET endpoint's successful responses, keyed by path and query string.
+    The entry is dropped when new messages arrive for any of `topics`.
+    Responses carry an ETag, and a matching If-None-Match is answered with 304.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.full_path
+            entry = response_cache.get(key)
+            if entry is not None:
+                response = Response(entry.body, mimetype="application/json")
+            else:
+                generation = response_cache.generation(topics)  # Before reading, see ResponseCache.put()
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                entry = response_cache.put(key, response.get_data(), topics, generation)
+
+            response.set_etag(entry.etag)
+            response.headers["Cache-Control"] = "no-cache"  # Clients revalidate with If-None-Match
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
+def prepare_message(data):
+    """
+    Validate a single MQTT message and convert it to the typed storage schema.
+    Binary payloads are sent base64 encoded with their content_type: camera frames
+    ("image/...") are moved to the image store, compact sensor readings are decoded.
+    Returns None if the message is invalid.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("topic"), str) or "payload" not in data:
+        return None
+    content_type = data.get("content_type") or ""
+    if not isinstance(content_type, str):
+        return None
+
+    # The timestamp defaults to now if not provided
+    try:
+        if content_type.startswith("image/"):
+            image = base64.b64decode(data["payload"], validate=True)
+            return normalize_image(data["topic"], image, images, data.get("timestamp"),
+                                   sensor=data.get("sensor"), content_type=content_type)
+        payload = data["payload"]
+        if content_type == COMPACT_CONTENT_TYPE:
+            payload = decode_payload(base64.b64decode(payload, validate=True), content_type)
+        return normalize_message(data["topic"], payload, data.get("timestamp"), images=images)
+    except (TypeError, ValueError, OverflowError, binascii.Error, struct.error):
+        return None
+
+
+def buffer_messages(messages):
+    """
+    Hand prepared messages to the write buffer and build the response.
+    Responds with 429 when the buffer is full and flags backpressure when it is close to full.
+    """
+    if not write_buffer.add(messages):
+        response = jsonify({"error": "Ingest buffer full, retry later", "backpressure": True})
+        response.headers["Retry-After"] = str(max(1, round(INGEST_FLUSH_INTERVAL)))
+        return response, 429
+    process_hot_state(messages)  # Before the write, alerts should not wait for the buffer
+
+    backpressure = write_buffer.saturation >= INGEST_HIGH_WATER_MARK
+    response = jsonify({
+        "message": "Data accepted",
+        "accepted": len(messages),
+        "pending": write_buffer.pending,
+        "backpressure": backpressure,
+    })
+    if backpressure:
+        response.headers["Retry-After"] = str(max(1, round(INGEST_FLUSH_INTERVAL)))
+    return response, 202
+
+
 @app.route("/save-mqtt-data", methods=["POST"])
 def save_mqtt_data():
     """
     Endpoint to save MQTT data into MongoDB.
     Expects JSON payload: { "topic": <string>, "payload": <string>, "timestamp": <string> }
+    The payload is parsed and the timestamp stored as a date (see storage.py).
+    The message is written asynchronously through the write buffer.
     """
     try:
-        data = request.json
-        if not data or "topic" not in data or "payload" not in data:
+        data = prepare_message(request.json)
+        if data is None:
             return jsonify({"error": "Invalid request"}), 400
 
-        # Add timestamp if not provided
-        if "timestamp" not in data:
-            data["timestamp"] = datetime.utcnow().isoformat()
+        return buffer_messages([data])
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        # Save to MongoDB
-        collection.insert_one(data)
-        return jsonify({"message": "Data saved successfully"}), 200
 
+@app.route("/save-mqtt-data/bulk", methods=["POST"])
+def save_mqtt_data_bulk():
+    """
+    Endpoint to save many MQTT messages in one request.
+    Accepts either a JSON array of messages or NDJSON (one message per line,
+    Content-Type: application/x-ndjson). Each message has the same shape as in /save-mqtt-data.
+    """
+    try:
+        if request.mimetype == "application/x-ndjson":
+            lines = request.get_data(as_text=True).splitlines()
+            data = [json.loads(line) for line in lines if line.strip()]
+        else:
+            data = request.get_json(silent=True)
+
+        if not isinstance(data, list):
+            return jsonify({"error": "Invalid request, expected a JSON array or NDJSON"}), 400
+
+        messages = []
+        for index, entry in enumerate(data):
+            message = prepare_message(entry)
+            if message is None:
+                return jsonify({"error": f"Invalid message at index {index}"}), 400
+            messages.append(message)
+
+        return buffer_messages(messages)
+
+    except json.JSONDecodeError as e:
+        return jsonify({"error": f"Invalid NDJSON: {e}"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+
+@app.route("/images/<digest>", methods=["GET"])
+def fetch_image(digest):
+    """
+    Endpoint to fetch a stored camera frame by the digest found in a message's image_ref.
+    Images never change for a given digest, so they can be cached forever.
+    """
+    if not re.fullmatch(r"[0-9a-f]{64}", digest):
+        return jsonify({"error": "Invalid image reference"}), 400
+
+    image = images.get(digest)
+    if image is None:
+        return jsonify({"error": "Image not found"}), 404
+
+    response = Response(image.read(), mimetype=image.content_type or "application/octet-stream")
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    response.set_etag(digest)
+    return response.make_conditional(request)
+
+
+@app.route("/ingest-stats", methods=["GET"])
+def ingest_stats():
+    """
+    Endpoint to inspect the write buffer (pending documents, throughput counters).
+    """
+    return jsonify(write_buffer.stats()), 200
+
+
+@app.route("/cache-stats", methods=["GET"])
+def cache_stats():
+    """
+    Endpoint to inspect the analytics response cache (entries, size, hit and miss counts).
+    """
+    return jsonify(response_cache.stats()), 200
+
+
+@app.route("/stream-stats", methods=["GET"])
+def stream_stats():
+    """
+    Endpoint to inspect the live update stream (connected, dropped and rejected clients).
+    """
+    return jsonify(broadcaster.stats()), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """
+    Endpoint exposing request latency per route, MongoDB command time and
+    documents scanned versus returned, in the Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def publish_live(docs):
+    """Send written messages to the /stream clients: the latest reading per topic and the hourly rollup deltas."""
+    latest = {}
+    for doc in docs:
+        current = latest.get(doc["topic"])
+        if current is None or doc["ts"] >= current["ts"]:
+            latest[doc["topic"]] = {"topic": doc["topic"], "sensor": doc.get("sensor"), "ts": doc["ts"], "payload": doc["payload"]}
+    broadcaster.update_state(list(latest.values()))
+
+    deltas = []
+    for (topic, sensor, bucket), stats in rollup_deltas(docs, hour_bucket).items():
+        delta = {"topic": topic, "sensor": sensor, "bucket": bucket, "count": stats["count"], "motion_hits": stats["motion_hits"]}
+        temps = stats["temps"]
+        if temps:
+            delta.update(temp_count=len(temps), temp_sum=sum(temps), temp_min=min(temps), temp_max=max(temps))
+        deltas.append(delta)
+    broadcaster.publish("rollup", deltas)
+
+
+def watch_changes():
+    """
+    Feed messages inserted by any process to the /stream clients, in batches.
+    Needs a replica set; time-series collections do not support change streams.
+    """
+    global STREAM_CHANGE_STREAM
+    try:
+        with collection.watch([{"$match": {"operationType": "insert"}}]) as changes:
+            while changes.alive:
+                docs = []
+                while len(docs) < INGEST_BATCH_SIZE:
+                    change = changes.try_next()  # None once no change arrived for a while
+                    if change is None:
+                        break
+                    docs.append(change["fullDocument"])
+                if docs:
+                    try:
+                        response_cache.invalidate({doc["topic"] for doc in docs})  # Also writes by other processes
+                        process_hot_state(docs)
+                        publish_live(docs)
+                    except Exception as e:
+                        print(f"Error publishing changes: {e}")  # Keep following the stream
+    except PyMongoError as e:
+        print(f"Change stream stopped, /stream only receives this process's writes: {e}")
+        STREAM_CHANGE_STREAM = False  # Fall back to publishing from on_flush
+
+
+def live_feed_complete():
+    """
+    True if this process sees every stored message: through the change stream, or as the only
+    server process. Messages stored by mqtt-ingest.py are only seen through the change stream.
+    """
+    return STREAM_CHANGE_STREAM or SERVER_WORKERS == 1
+
+
+def incomplete_feed_response():
+    error = "Each of the server workers only sees its own writes, set STREAM_CHANGE_STREAM=1 (needs a replica set)"
+    return jsonify({"error": error}), 503
+
+
+def process_hot_state(docs):
+    """Apply ingested messages to the hot state and push the alerts they raise to the /stream clients."""
+    for alert in anomalies.check(hot_state.update(docs)):
+        print(f"Alert: {alert['message']} ({alert['topic']})")
+        broadcaster.publish("alert", alert)
+
+
+def refresh_motion_profile():
+    """Reload the hourly motion profile used by the unusual motion rule, off the ingest path."""
+    while True:
+        try:
+            end = datetime.utcnow()
+            anomalies.set_motion_profile(rollups.motion_profile(hour_bucket(end - timedelta(days=MOTION_PROFILE_DAYS)), end))
+        except Exception as e:
+            print(f"Error loading the motion profile: {e}")  # Retried at the next refresh
+        time.sleep(MOTION_PROFILE_REFRESH)
+
+
+@app.route("/current-state", methods=["GET"])
+def current_state():
+    """
+    Endpoint returning the latest value of every sensor topic from memory, without a database query.
+    With ?history=1, each topic also carries its recent [ts, value] readings.
+    Answers 503 when several server workers run without the change stream, see live_feed_complete().
+    """
+    if not live_feed_complete():
+        return incomplete_feed_response()
+    history = request.args.get("history", "").lower() in ("1", "true", "yes")
+    body = json.dumps(hot_state.current(history=history), default=to_json_value)
+    return Response(body, mimetype="application/json")
+
+
+@app.route("/alerts", methods=["GET"])
+def alerts():
+    """
+    Endpoint returning the most recent alerts raised by the anomaly rules, newest first.
+    Alerts are also pushed to /stream clients as "alert" events.
+    Answers 503 when several server workers run without the change stream, see live_feed_complete().
+    """
+    if not live_feed_complete():
+        return incomplete_feed_response()
+    try:
+        limit = min(max(int(request.args.get("limit", 100)), 1), anomalies.alerts.maxlen)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    body = json.dumps(anomalies.recent(limit), default=to_json_value)
+    return Response(body, mimetype="application/json")
+
+
+@app.route("/stream", methods=["GET"])
+def stream():
+    """
+    Endpoint streaming live updates as Server-Sent Events, instead of clients polling the analytics endpoints.
+    "state" events carry readings (all latest readings on connect, then each new batch),
+    "rollup" events the increments of the hourly rollups and "alert" events the raised alerts.
+    Answers 503 when several server workers run without the change stream, since the deltas of one
+    worker would not add up to the analytics; clients then poll the analytics endpoints instead.
+    """
+    if not live_feed_complete():
+        return incomplete_feed_response()
+    subscription = broadcaster.subscribe()
+    if subscription is None:
+        return jsonify({"error": "Too many stream clients"}), 503, {"Retry-After": "5"}
+
+    def generate():
+        try:
+            yield b"retry: 3000\n\n"  # EventSource reconnect delay, in milliseconds
+            yield broadcaster.snapshot()
+            while True:
+                event = subscription.get(STREAM_KEEPALIVE)
+                if event is None:
+                    if subscription.closed:
+                        break  # Too far behind, the client reconnects and gets a fresh snapshot
+                    event = b": keepalive\n\n"
+                yield event
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(generate(), mimetype="text/event-stream", headers=headers)
+
     
+# Pagination Configuration for /fetch-mqtt-data
+FETCH_DEFAULT_LIMIT = 1000
+FETCH_MAX_LIMIT = 10000
+FETCH_BATCH_SIZE = 500  # Documents per MongoDB round trip while streaming
+DEFAULT_EXCLUDED_FIELDS = ["payload.image"]  # Inline base64 images from before images were stored separately
+
+
+def to_json_value(value):
+    """json.dumps fallback for BSON types."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def parse_time_arg(value):
+    """Parse a query string time given as a Unix timestamp or an ISO string."""
+    try:
+        return parse_timestamp(float(value))
+    except ValueError:
+        return parse_timestamp(value)
+
+
 @app.route("/fetch-mqtt-data", methods=["GET"])
 def fetch_mqtt_data():
     """
-    Endpoint to fetch all MQTT data from MongoDB.
+    Endpoint to fetch stored MQTT messages, one page at a time, as NDJSON (one message per line).
+    Query parameters (all optional):
+        limit   - Messages per page, default 1000, at most 10000
+        after   - _id of the last message of the previous page
+        after_ts - ts of that message, required with after on a time-series collection
+        topic   - Only messages of this topic
+        sensor  - Only messages of this sensor
+        since   - Only messages received at or after this time (ISO string or Unix timestamp)
+        until   - Only messages received before this time (ISO string or Unix timestamp)
+        fields  - Comma-separated fields to return, e.g. "topic,ts,payload.temperature"
+    Messages are returned in _id order, so the _id of the last line is the cursor for the next page.
+    On a time-series collection they are returned in (ts, _id) order, and the cursor is both values.
     """
     try:
-        # Retrieve all documents from the 'mqttMessages' collection
-        data = list(collection.find({}, {"_id": 0}))  # Exclude the default `_id` field
-        return jsonify(data), 200
+        limit = min(int(request.args.get("limit", FETCH_DEFAULT_LIMIT)), FETCH_MAX_LIMIT)
+        if limit <= 0:
+            return jsonify({"error": "limit must be positive"}), 400
+
+        query = {}
+        if "after" in request.args:
+            after = ObjectId(request.args["after"])
+            if not TIMESERIES:
+                query["_id"] = {"$gt": after}
+            elif "after_ts" in request.args:
+                after_ts = parse_time_arg(request.args["after_ts"])
+                query["$or"] = [{"ts": {"$gt": after_ts}}, {"ts": after_ts, "_id": {"$gt": after}}]
+            else:
+                raise ValueError("after_ts is required with after on a time-series collection")
+        if "topic" in request.args:
+            query["topic"] = request.args["topic"]
+        if "sensor" in request.args:
+            query["sensor"] = request.args["sensor"]
+        if "since" in request.args or "until" in request.args:
+            query["ts"] = {}
+            for arg, operator in (("since", "$gte"), ("until", "$lt")):
+                if arg in request.args:
+                    query["ts"][operator] = parse_time_arg(request.args[arg])
+
+        if "fields" in request.args:
+            projection = {field: 1 for field in request.args["fields"].split(",") if field}
+        else:
+            projection = {field: 0 for field in DEFAULT_EXCLUDED_FIELDS}
+
+        sort = [("ts", 1), ("_id", 1)] if TIMESERIES else [("_id", 1)]
+        cursor = collection.find(query, projection).sort(sort).limit(limit).batch_size(FETCH_BATCH_SIZE)
+
+    except (ValueError, OverflowError, OSError, InvalidId) as e:  # Out of range timestamps raise OverflowError or OSError
+        return jsonify({"error": f"Invalid request: {e}"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+    def generate():
+        # Documents are serialized one at a time, so memory use does not depend on the page size
+        try:
+            for doc in cursor:
+                yield json.dumps(doc, default=to_json_value) + "\n"
+        finally:
+            cursor.close()
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
     
 
 @app.route("/fetch-motion-data", methods=["GET"])
+@cached(MOTION_TOPIC)
 def fetch_motion_data():
     """
     Endpoint to fetch motion detection data for the last 7 days.
+    Returns one entry per calendar day (UTC), today last, with a 24-hour array,
+    1 meaning motion was detected in that hour.
+    Reads the hourly rollups, at most 7 x 24 buckets per sensor.
     """
     try:
-        # Set UTC timezone
-        utc = pytz.UTC
-
-        # Calculate the start and end of the last 7 days in UTC
-        end_date = utc.localize(datetime.utcnow())  # Make end_date offset-aware
-        start_date = end_date - timedelta(days=7)
-
-        # Initialize an empty list to hold the data for the last 7 days
-        motion_data = []
+        # Calculate the start of the first of the last 7 days, today included, in UTC
+        # Stored timestamps are naive UTC dates, so the bounds are naive as well
+        end_date = datetime.utcnow()
+        start_date = day_bucket(end_date) - timedelta(days=6)
 
-        # Query MongoDB for motion detection data for the last 7 days
         query = {
-            "topic": "home/security/door/motion",
-            "timestamp": {
-                "$gte": start_date.isoformat(),
-                "$lte": end_date.isoformat()
-            }
+            "topic": MOTION_TOPIC,
+            "bucket": {"$gte": start_date, "$lte": end_date},
+            "motion_hits": {"$gt": 0}
         }
 
-        # Fetch the data from the collection
-        data = list(collection.find(query, {"_id": 0, "timestamp": 1, "payload": 1}))
-
-        # Process the data for each of the last 7 days
-        for i in range(7):
-            day_data = [0] * 24  # Initialize array for 24 hours
-            day_start = start_date + timedelta(days=i)
-            day_end = day_start + timedelta(days=1)
-
-            for entry in data:
-                # Parse MongoDB timestamp
-                mongo_timestamp = entry["timestamp"]
-                if isinstance(mongo_timestamp, str):
-                    mongo_timestamp = parser.parse(mongo_timestamp).astimezone(utc)  # Ensure offset-aware
-
-                if day_start <= mongo_timestamp < day_end:
-                    # Parse the payload
-                    payload = entry["payload"]
-                    if isinstance(payload, str):
-                        payload = json.loads(payload)
-
-                    # Check if motion was detected
-                    motion_detected = payload.get("motion_detected", False)
-                    if motion_detected:
-                        # Extract the hour and update day_data
-                        hour = mongo_timestamp.hour
-                        day_data[hour] = 1
-
-            # Append processed data for the day
-            motion_data.append({
-                "date": day_start.strftime("%Y-%m-%d"),
+        # Initialize the 7 x 24 hour grid
+        grid = [[0] * 24 for _ in range(7)]
+        for r in rollups.hourly.find(query, {"_id": 0, "bucket": 1}):
+            day = (r["bucket"].date() - start_date.date()).days
+            if 0 <= day < 7:
+                grid[day][r["bucket"].hour] = 1
+
+        motion_data = [
+            {
+                "date": (start_date + timedelta(days=i)).strftime("%Y-%m-%d"),
                 "motion_data": day_data
-            })
+            }
+            for i, day_data in enumerate(grid)
+        ]
 
         return jsonify(motion_data), 200
 
@@ -122,64 +614,35 @@ def fetch_motion_data():
     
 
 @app.route("/motion-insights", methods=["GET"])
+@cached(MOTION_TOPIC)
 def motion_insights():
     """
     Endpoint to fetch insights about motion detection over the last 30 days.
+    Reads the hourly rollups, at most 30 x 24 buckets per sensor.
     """
     try:
         # Calculate the start and end of the last 30 days
         end_date = datetime.utcnow()
-        start_date = end_date - timedelta(days=30)
+        start_date = hour_bucket(end_date - timedelta(days=30))
 
-        # Query MongoDB for motion detection data for the last 30 days
         query = {
-            "topic": "home/security/door/motion",
-            "timestamp": {
-                "$gte": start_date.isoformat(),  # Ensure query is in ISO format
-                "$lte": end_date.isoformat()     # Ensure query is in ISO format
-            }
+            "topic": MOTION_TOPIC,
+            "bucket": {"$gte": start_date, "$lte": end_date},
+            "motion_hits": {"$gt": 0}
         }
 
-        # Fetch the data from the collection
-        data = list(collection.find(query, {"_id": 0, "timestamp": 1, "payload": 1}))
-
         # Initialize variables for insights
         total_motion_count = 0
         daily_motion_counts = {}
         hourly_motion_counts = [0] * 24  # 24-hour distribution
 
-        # Process the data
-        for entry in data:
-            timestamp = entry["timestamp"]
-            motion_detected = False
-            if isinstance(timestamp, str):  # If stored as string, parse it to datetime
-                timestamp = datetime.fromisoformat(timestamp)
-            day = timestamp.strftime("%Y-%m-%d")
-            hour = timestamp.hour
-
-            # Parse the payload to check if motion was detected
-            payload = entry["payload"]
-            if isinstance(payload, str):  # The payload is a string, so we need to parse it
-                try:
-                    payload = json.loads(payload)  # Safely convert string to dictionary
-                    # Convert Unix timestamp to datetime
-                    payload_timestamp = payload.get("timestamp", None)
-                    if payload_timestamp:
-                        payload["timestamp"] = datetime.utcfromtimestamp(payload_timestamp)  # Convert to datetime
-                except json.JSONDecodeError as e:
-                    print(f"Error parsing payload: {e}")
-                    continue  # Skip this entry if payload parsing fails
-
-            motion_detected = payload.get("motion_detected", False)
-
-            if motion_detected:
-                total_motion_count += 1
-                # Update daily counts
-                if day not in daily_motion_counts:
-                    daily_motion_counts[day] = 0
-                daily_motion_counts[day] += 1
-                # Update hourly distribution
-                hourly_motion_counts[hour] += 1
+        # Fold the hourly buckets into daily and hourly counts
+        for r in rollups.hourly.find(query, {"_id": 0, "bucket": 1, "motion_hits": 1}):
+            day = r["bucket"].strftime("%Y-%m-%d")
+            count = r["motion_hits"]
+            total_motion_count += count
+            daily_motion_counts[day] = daily_motion_counts.get(day, 0) + count
+            hourly_motion_counts[r["bucket"].hour] += count
 
         # Identify insights
         max_day = max(daily_motion_counts, key=daily_motion_counts.get, default="N/A")
@@ -189,7 +652,8 @@ def motion_insights():
         # Construct the insights response
         insights = {
             "total_motion_detections": total_motion_count,
-            "daily_motion_counts": daily_motion_counts,
+            "daily_motion_counts": dict(sorted(daily_motion_counts.items())),
+            "hourly_motion_counts": hourly_motion_counts,
             "peak_hours": peak_hours,
             "day_with_highest_motion": {"date": max_day, "count": daily_motion_counts.get(max_day, 0)},
             "day_with_lowest_motion": {"date": min_day, "count": daily_motion_counts.get(min_day, 0)}
@@ -202,51 +666,27 @@ def motion_insights():
         return jsonify({"error": str(e)}), 500
     
 @app.route("/fetch-historical-data", methods=["GET"])
+@cached(MOTION_TOPIC)
 def fetch_historical_data():
     """
     Endpoint to fetch aggregated daily motion detection data for the last 90 days.
+    Reads the daily rollups, at most 90 buckets per sensor.
     """
     try:
         # Calculate the start and end dates for the last 90 days
         end_date = datetime.utcnow()
-        start_date = end_date - timedelta(days=90)
+        start_date = day_bucket(end_date - timedelta(days=90))
 
-        # MongoDB aggregation pipeline
-        pipeline = [
-            {
-                "$match": {
-                    "topic": "home/security/door/motion",
-                    "timestamp": {"$gte": start_date.isoformat(), "$lte": end_date.isoformat()}
-                }
-            },
-            {
-                "$project": {
-                    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": {"$toDate": "$timestamp"}}},
-                    "payload": 1
-                }
-            },
-            {
-                "$group": {
-                    "_id": "$day",
-                    "total_motions": {
-                        "$sum": {
-                            "$cond": [
-                                {"$eq": [True, {"$toBool": {"$toBool": "$payload.motion_detected"}}]},
-                                1,
-                                0
-                            ]
-                        }
-                    }
-                }
-            },
-            {"$sort": {"_id": 1}}  # Sort by date
-        ]
+        query = {"topic": MOTION_TOPIC, "bucket": {"$gte": start_date, "$lte": end_date}}
 
-        # Execute the aggregation query
-        results = list(collection.aggregate(pipeline))
+        # Sum the sensors of each day
+        daily_totals = {}
+        for r in rollups.daily.find(query, {"_id": 0, "bucket": 1, "motion_hits": 1}):
+            day = r["bucket"].strftime("%Y-%m-%d")
+            daily_totals[day] = daily_totals.get(day, 0) + r["motion_hits"]
 
-        # Format the results as a JSON response
-        historical_data = [{"date": r["_id"], "total_motions": r["total_motions"]} for r in results]
+        # Format the results as a JSON response, sorted by date
+        historical_data = [{"date": day, "total_motions": total} for day, total in sorted(daily_totals.items())]
 
         return jsonify(historical_data), 200
 
@@ -254,6 +694,15 @@ def fetch_historical_data():
         print(f"Error fetching historical data: {e}")
         return jsonify({"error": str(e)}), 500
 
+# Background threads, started once every function they use is defined
+if STREAM_CHANGE_STREAM:
+    threading.Thread(target=watch_changes, name="stream-change-stream", daemon=True).start()
+threading.Thread(target=refresh_motion_profile, name="motion-profile", daemon=True).start()
+threading.Thread(target=run_image_expiry, args=(images, collection), name="image-expiry", daemon=True).start()
+
+# Development server, see wsgi.py and gunicorn.conf.py for production
+FLASK_DEBUG = os.getenv("FLASK_DEBUG", "0").lower() in ("1", "true", "yes")
+PORT = int(os.getenv("PORT", "5000"))
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    app.run(host="0.0.0.0", port=PORT, debug=FLASK_DEBUG, threaded=True)
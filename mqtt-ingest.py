@@ -0,0 +1,257 @@
+import paho.mqtt.client as mqtt
+from pymongo import MongoClient
+from types import SimpleNamespace
+import argparse
+import json
+import os
+import queue
+import random
+import threading
+import time
+from write_buffer import WriteBuffer
+from wire_format import decode_payload, decode_batch, is_batch
+from storage import DATABASE_NAME, COLLECTION_NAME, IMAGE_BUCKET_NAME, get_collection, normalize_message, normalize_image, ensure_indexes, run_image_expiry, Rollups, ImageStore
+
+# --- MQTT Configuration ---
+MQTT_BROKER = os.getenv("MQTT_BROKER", "localhost")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+MQTT_TOPIC = "home/#"  # Everything published by sensors.py
+
+# --- MongoDB Configuration ---
+MONGO_URI = os.getenv("DATABASE_URL")
+
+# --- Ingest Configuration ---
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))  # Decoding threads
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "100000"))  # Raw messages waiting to be decoded
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1000"))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "0.5"))  # Seconds
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "100000"))
+REPORT_INTERVAL = 10  # Seconds between throughput reports
+
+
+class IngestService:
+    """
+    Subscribes to the sensor topics and writes every message to MongoDB.
+    The MQTT network thread only enqueues raw messages; a pool of worker threads
+    decodes them and hands them to a WriteBuffer, whose flusher thread does the I/O.
+    Every written batch is also folded into the hourly and daily rollups.
+    Binary camera frames are stored in the ImageStore and only referenced from the message.
+    """
+
+    def __init__(self, collection, rollups, images, workers=INGEST_WORKERS):
+        self.rollups = rollups
+        self.images = images
+        self.queue = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+        self.buffer = WriteBuffer(
+            collection,
+            max_batch_size=INGEST_BATCH_SIZE,
+            max_age=INGEST_FLUSH_INTERVAL,
+            max_pending=INGEST_MAX_PENDING,
+            on_flush=self._on_flush,
+        )
+        self.workers = [
+            threading.Thread(target=self._work, name=f"ingest-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        self._stats_lock = threading.Lock()
+        self._received = 0
+        self._decode_errors = 0
+        self._lag_samples = []  # End-to-end lag in seconds, sampled once per written batch
+        self._running = False
+
+    # --- MQTT callbacks ---
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        """Callback for MQTT connect."""
+        if rc == 0:
+            print("Connected to MQTT Broker!")
+            # Messages are delivered at the lower of the publish and subscription QoS,
+            # so subscribe at QoS 1 to keep the QoS 1 of smoke, motion and camera messages
+            client.subscribe(MQTT_TOPIC, qos=1)
+        else:
+            print(f"Failed to connect, return code {rc}")
+
+    def on_message(self, client, userdata, msg):
+        """Callback for MQTT messages, kept as short as possible."""
+        # Retained messages replayed on subscribe were already stored when first published
+        if getattr(msg, "retain", False):
+            return
+        # Blocks when the queue is full, which stops reading from the broker socket
+        self.queue.put((msg.topic, msg.payload, time.time(), getattr(msg, "properties", None)))
+        with self._stats_lock:
+            self._received += 1
+
+    # --- Processing ---
+    def start(self):
+        self._running = True
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        """Wait for queued messages to be decoded, then flush them to MongoDB."""
+        self.queue.join()
+        self._running = False
+        self.buffer.close()
+
+    def decode(self, topic, payload, received_at, properties=None):
+        """
+        Decode a raw MQTT payload into typed documents for the mqttMessages collection.
+        Returns a list, since a batch message carries several readings.
+        """
+        content_type = getattr(properties, "ContentType", None) or ""
+        if content_type.startswith("image/"):
+            # Raw image bytes, metadata is carried in the MQTT v5 user properties
+            user_properties = dict(getattr(properties, "UserProperty", []))
+            sent_at = user_properties.get("timestamp")
+            return [normalize_image(topic, payload, self.images, received_at,
+                                    sensor=user_properties.get("sensor"),
+                                    sent_at=float(sent_at) if sent_at else None,
+                                    content_type=content_type)]
+        if is_batch(content_type):
+            # Readings of several sensors, with topics relative to the home prefix
+            home = topic.rsplit("/", 1)[0]
+            return [
+                normalize_message(f"{home}/{reading_topic}", reading, received_at, images=self.images)
+                for reading_topic, reading in decode_batch(payload, content_type)
+            ]
+        # JSON or compact binary readings, see wire_format.py
+        payload = decode_payload(payload, content_type)
+        return [normalize_message(topic, payload, received_at, images=self.images)]
+
+    def _work(self):
+        while True:
+            topic, payload, received_at, properties = self.queue.get()
+            try:
+                docs = self.decode(topic, payload, received_at, properties)
+                # Wait for the write buffer to drain instead of dropping the message
+                while not self.buffer.add(docs):
+                    time.sleep(INGEST_FLUSH_INTERVAL / 10)
+            except Exception as e:
+                # Malformed payloads and image store errors must not end the worker
+                print(f"Error decoding message on {topic}: {e}")
+                with self._stats_lock:
+                    self._decode_errors += 1
+            finally:
+                self.queue.task_done()
+
+    def _on_flush(self, docs):
+        self.rollups.update(docs)
+
+        # Sample the lag of the oldest message in the batch (sensor timestamp to write)
+        payload = docs[0]["payload"]
+        sent_at = payload.get("timestamp") if isinstance(payload, dict) else None
+        if isinstance(sent_at, (int, float)):
+            with self._stats_lock:
+                self._lag_samples.append(time.time() - sent_at)
+
+    # --- Reporting ---
+    def report(self, interval):
+        """Return throughput and lag since the last report, and reset the counters."""
+        with self._stats_lock:
+            received, self._received = self._received, 0
+            lag, self._lag_samples = self._lag_samples, []
+            decode_errors = self._decode_errors
+        return {
+            "messages_per_sec": round(received / interval, 1),
+            "lag_avg_ms": round(sum(lag) / len(lag) * 1000, 1) if lag else None,
+            "lag_max_ms": round(max(lag) * 1000, 1) if lag else None,
+            "queued": self.queue.qsize(),
+            "decode_errors": decode_errors,
+            **self.buffer.stats(),
+        }
+
+    def run_reporter(self):
+        while self._running:
+            time.sleep(REPORT_INTERVAL)
+            print("Ingest stats:", json.dumps(self.report(REPORT_INTERVAL)))
+
+
+class LocalBroker:
+    """
+    Minimal in-process stand-in for an MQTT broker.
+    Messages published here are delivered straight to the subscriber's on_message callback,
+    so the ingest pipeline can be exercised without a running Mosquitto (see tests/).
+    `properties` stands in for the MQTT v5 properties, e.g. SimpleNamespace(ContentType=...).
+    """
+
+    def __init__(self, on_message):
+        self.on_message = on_message
+
+    def publish(self, topic, payload, retain=False, properties=None):
+        message = SimpleNamespace(topic=topic, payload=payload, retain=retain, properties=properties)
+        self.on_message(self, None, message)
+
+
+def run_benchmark(collection, rollups, images, count):
+    """Push `count` synthetic sensor messages through the ingest pipeline and report throughput and lag."""
+    service = IngestService(collection, rollups, images)
+    service.start()
+    broker = LocalBroker(service.on_message)
+
+    start = time.time()
+    for i in range(count):
+        payload = json.dumps({
+            "sensor": "motion_sensor_1",
+            "motion_detected": random.choice([True, False]),
+            "timestamp": time.time(),
+        })
+        broker.publish("home/security/door/motion", payload.encode("utf-8"))
+    service.stop()
+    elapsed = time.time() - start
+
+    stats = service.report(elapsed)
+    print(f"Ingested {stats['written']} of {count} messages in {elapsed:.2f}s")
+    print("Benchmark stats:", json.dumps(stats))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Subscribe to the sensor topics and store messages in MongoDB.")
+    arg_parser.add_argument("--benchmark", type=int, metavar="N",
+                            help="Ingest N synthetic messages through a local broker stand-in and exit")
+    args = arg_parser.parse_args()
+
+    client = MongoClient(MONGO_URI)
+    db = client[DATABASE_NAME]
+
+    if args.benchmark:
+        # Use a scratch collection so benchmark data never mixes with real readings
+        collection = get_collection(db, "benchmark_" + COLLECTION_NAME)
+        rollups = Rollups(db, prefix="benchmark_")
+        images = ImageStore(db, prefix="benchmark_")
+        ensure_indexes(collection)
+        rollups.ensure_indexes()
+        try:
+            run_benchmark(collection, rollups, images, args.benchmark)
+        finally:
+            collection.drop()
+            rollups.hourly.drop()
+            rollups.daily.drop()
+            db.drop_collection(f"benchmark_{IMAGE_BUCKET_NAME}.files")
+            db.drop_collection(f"benchmark_{IMAGE_BUCKET_NAME}.chunks")
+        return
+
+    collection = get_collection(db)
+    rollups = Rollups(db)
+    ensure_indexes(collection)
+    rollups.ensure_indexes()
+    images = ImageStore(db)
+    service = IngestService(collection, rollups, images)
+    service.start()
+    threading.Thread(target=service.run_reporter, name="ingest-reporter", daemon=True).start()
+    threading.Thread(target=run_image_expiry, args=(images, collection), name="image-expiry", daemon=True).start()
+
+    mqtt_client = mqtt.Client(protocol=mqtt.MQTTv5)
+    mqtt_client.on_connect = service.on_connect
+    mqtt_client.on_message = service.on_message
+    mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
+
+    try:
+        mqtt_client.loop_forever()
+    except KeyboardInterrupt:
+        print("Stopping ingest, flushing buffered messages...")
+    finally:
+        mqtt_client.disconnect()
+        service.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+
+class CacheEntry:
+    """A cached response body with its ETag and the MQTT topics it was computed from."""
+
+    __slots__ = ("body", "etag", "topics", "expires_at")
+
+    def __init__(self, body, topics, ttl):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.topics = frozenset(topics)
+        self.expires_at = time.monotonic() + ttl
+
+
+class ResponseCache:
+    """
+    In-memory LRU cache for computed endpoint responses.
+    Entries expire after `ttl` seconds, the least recently used entries are evicted once
+    the cache holds more than `max_entries` entries or `max_bytes` bytes of response bodies,
+    and invalidate() drops every entry computed from a topic that received new data.
+    Each invalidation also moves the topic to a new generation, so a response computed
+    before an invalidation and put afterwards is not cached (see generation()).
+    """
+
+    def __init__(self, ttl=60, max_entries=256, max_bytes=8 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._size = 0  # Total bytes of cached bodies
+        self._generations = {}  # Invalidation count by topic
+        self._lock = threading.Lock()
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return the entry for key, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def generation(self, topics):
+        """The current generation of `topics`, to be taken before computing a response and passed to put()."""
+        with self._lock:
+            return tuple(self._generations.get(topic, 0) for topic in topics)
+
+    def put(self, key, body, topics, generation=None):
+        """
+        Cache a response body computed from `topics` and return the new entry.
+        If `topics` were invalidated since `generation` was taken, the body may predate the new
+        data and is not cached.
+        """
+        entry = CacheEntry(body, topics, self.ttl)
+        if len(body) > self.max_bytes:
+            return entry  # Never cacheable, but the caller still gets an ETag
+
+        with self._lock:
+            if generation is not None and generation != tuple(self._generations.get(topic, 0) for topic in topics):
+                return entry  # Invalidated while the response was computed
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._size += len(body)
+
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, topics):
+        """Drop every entry computed from any of `topics`."""
+        topics = set(topics)
+        with self._lock:
+            for topic in topics:
+                self._generations[topic] = self._generations.get(topic, 0) + 1
+            stale = [key for key, entry in self._entries.items() if not entry.topics.isdisjoint(topics)]
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._size -= len(entry.body)
@@ -1,9 +1,17 @@
 import paho.mqtt.client as mqtt
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
+import argparse
+import heapq
 import json
+import multiprocessing
+import threading
 import time
 import random
-import base64
+import struct
 from builtins import FileNotFoundError, print, open, round
+import wire_format
+from stats import percentile
 
 # --- MQTT Configuration ---
 MQTT_BROKER = "localhost"
@@ -19,6 +27,33 @@ MQTT_TOPIC_WINDOW_CAMERA_IMAGE = "home/camera/window/image"
 MQTT_TOPIC_WINDOW_CAMERA_MOTION = "home/camera/window/motion"
 MQTT_TOPIC_LIGHT = "home/security/light"  # Topic for light sensor data
 MQTT_TOPIC_SMOKE = "home/security/smoke"  # Topic for smoke sensor data
+MQTT_HOME_PREFIX = "home"
+MQTT_TOPIC_BATCH = f"{MQTT_HOME_PREFIX}/{wire_format.BATCH_TOPIC}"  # Batched readings of the whole home
+
+# --- QoS Configuration ---
+# QoS by sensor class, matched against the topic levels. Alarms and camera events must arrive,
+# a lost temperature or light reading is superseded by the next one anyway.
+SENSOR_QOS = {
+    "smoke": 1,
+    "motion": 1,
+    "camera": 1,
+    "temperature": 0,
+    "light": 0,
+}
+
+# --- Report-by-Exception Configuration ---
+TEMPERATURE_DEADBAND = 0.5  # Degrees the temperature must move before it is published again
+HEARTBEAT_INTERVAL = 60  # Seconds after which an unchanged value is published anyway
+
+# --- Payload Format ---
+# "json" or "compact" (see wire_format.py), compact payloads carry an MQTT v5 content type
+PAYLOAD_FORMATS = ("json", "compact")
+
+# --- Camera Configuration ---
+DOOR_CAMERA_IMAGE = "placeholder_image_1_40.jpg"
+WINDOW_CAMERA_IMAGE = "window-image.jpg"
+IMAGE_CONTENT_TYPE = "image/jpeg"
+_image_cache = {}  # Image bytes by file name, each placeholder is read from disk once
 
 # --- Sensor Data Simulation Functions ---
 def simulate_door_motion_sensor():
@@ -49,33 +84,51 @@ def simulate_temperature_sensor():
         "timestamp": time.time()
     }
 
+def load_image(file_name):
+    """Reads an image file once and returns its bytes, or None if it does not exist."""
+    if file_name not in _image_cache:
+        try:
+            with open(file_name, "rb") as image_file:
+                _image_cache[file_name] = image_file.read()
+        except FileNotFoundError:
+            print("Error: Placeholder image not found.")
+            return None
+    return _image_cache[file_name]
+
 def capture_door_image():
     """Simulates capturing an image from the camera."""
-    try:
-        with open("placeholder_image_1_40.jpg", "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
-        return {
+    image = load_image(DOOR_CAMERA_IMAGE)
+    if image is None:
+        return None
+    return {
         "sensor": "door_camera_1",
-        "image": encoded_string,
+        "image": image,
         "timestamp": time.time()
     }
-    except FileNotFoundError:
-        print("Error: Placeholder image not found.")
-        return None
     
 def capture_window_image():
     """Simulates capturing an image from the camera."""
-    try:
-        with open("window-image.jpg", "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
-        return {
+    image = load_image(WINDOW_CAMERA_IMAGE)
+    if image is None:
+        return None
+    return {
         "sensor": "window_camera_1",
-        "image": encoded_string,
+        "image": image,
         "timestamp": time.time()
     }
-    except FileNotFoundError:
-        print("Error: Placeholder image not found.")
-        return None
+
+def publish_image(client, topic, image_data):
+    """
+    Publishes a camera frame as a raw binary payload.
+    The sensor id and timestamp travel as MQTT v5 user properties instead of a JSON envelope.
+    """
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.ContentType = IMAGE_CONTENT_TYPE
+    properties.UserProperty = [
+        ("sensor", image_data["sensor"]),
+        ("timestamp", str(image_data["timestamp"])),
+    ]
+    client.publish(topic, image_data["image"], qos=qos_for_topic(topic), properties=properties)
 
 def simulate_light_sensor(motion_detected):
     """Simulates light sensor data based on motion detection."""
@@ -111,59 +164,440 @@ def on_connect(client, userdata, flags, rc, properties=None):
     else:
         print(f"Failed to connect, return code {rc}")
 
-client = mqtt.Client(protocol=mqtt.MQTTv5)
-client.on_connect = on_connect
-client.connect(MQTT_BROKER, MQTT_PORT, 60)
-client.loop_start()
+def qos_for_topic(topic):
+    """Returns the QoS configured in SENSOR_QOS for the sensor class of a topic."""
+    levels = topic.split("/")
+    return max((qos for sensor_class, qos in SENSOR_QOS.items() if sensor_class in levels), default=0)
+
+class TopicAliasPublisher:
+    """
+    Publishes through an MQTT v5 client, replacing repeated topics with topic aliases.
+    The first message on a topic carries the topic and a new alias, later QoS 0 messages only
+    the alias and an empty topic. The broker's TopicAliasMaximum from CONNACK bounds the number
+    of aliases, and they are forgotten on reconnect since they only live for one connection.
+    QoS 1 messages always carry the full topic, because paho resends them after a reconnect.
+    """
+
+    def __init__(self, client, enabled=True):
+        self.client = client
+        self.enabled = enabled
+        self.max_aliases = 0  # Until the broker announces its maximum
+        self._aliases = {}  # Alias by topic
+        self._lock = threading.Lock()
+
+        # Counters for load mode
+        self.packets = 0
+        self.sent_bytes = 0  # Topic and payload bytes, the part of a PUBLISH packet aliases shrink
+
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        on_connect(client, userdata, flags, rc, properties)
+        with self._lock:
+            self._aliases = {}
+            self.max_aliases = getattr(properties, "TopicAliasMaximum", 0) if rc == 0 and self.enabled else 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        """Same signature and return value as mqtt.Client.publish()."""
+        with self._lock:
+            alias = self._aliases.get(topic)
+            new_alias = alias is None and len(self._aliases) < self.max_aliases
+            if new_alias:
+                alias = self._aliases[topic] = len(self._aliases) + 1
+
+        if alias is not None:
+            aliased = Properties(PacketTypes.PUBLISH)
+            for name in ("ContentType", "UserProperty"):
+                if properties is not None and hasattr(properties, name):
+                    setattr(aliased, name, getattr(properties, name))
+            aliased.TopicAlias = alias
+            properties = aliased
+            if not new_alias and qos == 0:
+                topic = ""
+
+        info = self.client.publish(topic, payload, qos=qos, retain=retain, properties=properties)
+        self.packets += 1
+        self.sent_bytes += len(topic) + (len(payload) if payload else 0)
+        return info
+
+def connect_client(topic_aliases=True):
+    """
+    Creates an MQTT v5 client connected to the broker, with its network loop running.
+    Returns a TopicAliasPublisher wrapping it, which can be used in place of the client.
+    """
+    client = mqtt.Client(protocol=mqtt.MQTTv5)
+    publisher = TopicAliasPublisher(client, enabled=topic_aliases)
+    client.on_connect = publisher.on_connect
+    client.connect(MQTT_BROKER, MQTT_PORT, 60)
+    client.loop_start()
+    return publisher
 
 # --- Publish Sensor Data ---
-motion_detected = False  # Tracks the last motion state
-
-while True:
-    # Simulate and publish door motion sensor data
-    current_door_motion_data = simulate_door_motion_sensor()
-    current_door_motion = current_door_motion_data["motion_detected"]
-    client.publish(MQTT_TOPIC_DOOR_MOTION, json.dumps(current_door_motion_data))
-    print("Published Door Motion Sensor Data:", json.dumps(current_door_motion_data, indent=4))
-
-    # Simulate and publish window motion sensor data
-    current_window_motion_data = simulate_window_motion_sensor()
-    current_window_motion = current_window_motion_data["motion_detected"]
-    client.publish(MQTT_TOPIC_WINDOW_MOTION, json.dumps(current_window_motion_data))
-    print("Published Window Motion Sensor Data:", json.dumps(current_window_motion_data, indent=4))
-
-    # Simulate and publish temperature sensor data
-    temperature_data = simulate_temperature_sensor()
-    client.publish(MQTT_TOPIC_TEMPERATURE, json.dumps(temperature_data))
-    print("Published Temperature Sensor Data:", json.dumps(temperature_data, indent=4))
-
-    # Simulate light sensor data based on motion detection
-    light_data = simulate_light_sensor(current_door_motion)
-    client.publish(MQTT_TOPIC_LIGHT, json.dumps(light_data))
-    print("Published Light Sensor Data:", json.dumps(light_data, indent=4))
-
-    # Simulate and publish smoke sensor data
-    smoke_data = simulate_smoke_sensor()
-    client.publish(MQTT_TOPIC_SMOKE, json.dumps(smoke_data))
-    print("Published smoke Sensor Data:", json.dumps(smoke_data, indent=4))
-
-    # Publish image only when door motion state changes to True
-    if current_door_motion and not motion_detected:
-        image_data = capture_door_image()
-        if image_data:
-            client.publish(MQTT_TOPIC_DOOR_CAMERA_IMAGE, json.dumps(image_data))
-            client.publish(MQTT_TOPIC_DOOR_CAMERA_MOTION, "1")
-            print("Published Door Camera Image", json.dumps(image_data))
-
-    # Publish image only when window motion state changes to True
-    if current_window_motion and not motion_detected:
-        image_data = capture_window_image()
-        if image_data:
-            client.publish(MQTT_TOPIC_WINDOW_CAMERA_IMAGE, json.dumps(image_data))
-            client.publish(MQTT_TOPIC_WINDOW_CAMERA_MOTION, "1")
-            print("Published Window Camera Image", json.dumps(image_data))
-
-    # Update the motion state
-
-    # Wait for 5 seconds before sending the next set of data
-    time.sleep(5)
+def encode_reading(data, payload_format="json"):
+    """Encodes a sensor reading, returns the payload and the MQTT v5 properties to publish it with."""
+    if payload_format == "compact":
+        properties = Properties(PacketTypes.PUBLISH)
+        properties.ContentType = wire_format.COMPACT_CONTENT_TYPE
+        return wire_format.encode(data), properties
+    return json.dumps(data), None
+
+class ExceptionReporter:
+    """
+    Publishes a sensor reading only when it differs from the last published one:
+    boolean states on every change, numeric values when they move more than a deadband.
+    Unchanged values are republished every heartbeat_interval seconds, and all messages
+    are retained so late subscribers immediately get the current state.
+    With publish_all, every reading is published (the previous behaviour).
+
+    With batch, readings are collected instead and flush() publishes them as one message
+    on MQTT_TOPIC_BATCH (see wire_format.py), at the highest QoS of the sensors in it.
+    Batches are not retained, since one only holds the readings that changed.
+    """
+
+    def __init__(self, client, heartbeat_interval=HEARTBEAT_INTERVAL, publish_all=False, payload_format="json",
+                 batch=False):
+        self.client = client
+        self.heartbeat_interval = heartbeat_interval
+        self.publish_all = publish_all
+        self.payload_format = payload_format
+        self.batch = batch
+        self._last = {}  # Last published value and time by topic
+        self._pending = []  # Readings for the next batch: (topic, data)
+
+    def publish(self, topic, data, key, deadband=0):
+        """Publishes data if data[key] changed enough, returns True if it was published."""
+        value = data[key]
+        now = time.monotonic()
+        last = self._last.get(topic)
+        if last is not None and not self.publish_all:
+            last_value, published_at = last
+            changed = abs(value - last_value) > deadband if deadband else value != last_value
+            if not changed and now - published_at < self.heartbeat_interval:
+                return False
+
+        if self.batch:
+            self._pending.append((topic, data))
+        else:
+            payload, properties = encode_reading(data, self.payload_format)
+            self.client.publish(topic, payload, qos=qos_for_topic(topic), retain=True, properties=properties)
+        self._last[topic] = (value, now)
+        return True
+
+    def flush(self):
+        """Publishes the collected readings as one batch message, returns how many it held."""
+        if not self._pending:
+            return 0
+        readings = [(topic[len(MQTT_HOME_PREFIX) + 1:], data) for topic, data in self._pending]
+        payload, content_type = wire_format.encode_batch(readings, self.payload_format)
+        properties = Properties(PacketTypes.PUBLISH)
+        properties.ContentType = content_type
+        qos = max(qos_for_topic(topic) for topic, _ in self._pending)
+        self.client.publish(MQTT_TOPIC_BATCH, payload, qos=qos, properties=properties)
+        self._pending = []
+        return len(readings)
+
+def run_simulator(client, publish_all=False, payload_format="json", batch=False):
+    """Simulates a single home, reading every sensor every 5 seconds and publishing the changes."""
+    reporter = ExceptionReporter(client, publish_all=publish_all, payload_format=payload_format, batch=batch)
+    motion_detected = False  # Tracks the last motion state
+
+    while True:
+        # Simulate and publish door motion sensor data
+        current_door_motion_data = simulate_door_motion_sensor()
+        current_door_motion = current_door_motion_data["motion_detected"]
+        if reporter.publish(MQTT_TOPIC_DOOR_MOTION, current_door_motion_data, "motion_detected"):
+            print("Published Door Motion Sensor Data:", current_door_motion_data)
+
+        # Simulate and publish window motion sensor data
+        current_window_motion_data = simulate_window_motion_sensor()
+        current_window_motion = current_window_motion_data["motion_detected"]
+        if reporter.publish(MQTT_TOPIC_WINDOW_MOTION, current_window_motion_data, "motion_detected"):
+            print("Published Window Motion Sensor Data:", current_window_motion_data)
+
+        # Simulate and publish temperature sensor data
+        temperature_data = simulate_temperature_sensor()
+        if reporter.publish(MQTT_TOPIC_TEMPERATURE, temperature_data, "temperature", deadband=TEMPERATURE_DEADBAND):
+            print("Published Temperature Sensor Data:", temperature_data)
+
+        # Simulate light sensor data based on motion detection
+        light_data = simulate_light_sensor(current_door_motion)
+        if reporter.publish(MQTT_TOPIC_LIGHT, light_data, "light_on"):
+            print("Published Light Sensor Data:", light_data)
+
+        # Simulate and publish smoke sensor data
+        smoke_data = simulate_smoke_sensor()
+        if reporter.publish(MQTT_TOPIC_SMOKE, smoke_data, "smoke_detected"):
+            print("Published smoke Sensor Data:", smoke_data)
+
+        # In batch mode the readings above were only collected
+        batched = reporter.flush()
+        if batched:
+            print(f"Published batch of {batched} readings")
+
+        # Publish image only when door motion state changes to True
+        if current_door_motion and not motion_detected:
+            image_data = capture_door_image()
+            if image_data:
+                publish_image(client, MQTT_TOPIC_DOOR_CAMERA_IMAGE, image_data)
+                client.publish(MQTT_TOPIC_DOOR_CAMERA_MOTION, "1", qos=qos_for_topic(MQTT_TOPIC_DOOR_CAMERA_MOTION))
+                print(f"Published Door Camera Image ({len(image_data['image'])} bytes)")
+
+        # Publish image only when window motion state changes to True
+        if current_window_motion and not motion_detected:
+            image_data = capture_window_image()
+            if image_data:
+                publish_image(client, MQTT_TOPIC_WINDOW_CAMERA_IMAGE, image_data)
+                client.publish(MQTT_TOPIC_WINDOW_CAMERA_MOTION, "1", qos=qos_for_topic(MQTT_TOPIC_WINDOW_CAMERA_MOTION))
+                print(f"Published Window Camera Image ({len(image_data['image'])} bytes)")
+
+        # Update the motion state
+
+        # Wait for 5 seconds before sending the next set of data
+        time.sleep(5)
+
+# --- Load Generation ---
+# Sensors simulated per home in load mode: name -> (topic below the home prefix, simulation function)
+LOAD_SENSORS = {
+    "door_motion": ("security/door/motion", simulate_door_motion_sensor),
+    "window_motion": ("security/window/motion", simulate_window_motion_sensor),
+    "temperature": ("sensors/temperature", simulate_temperature_sensor),
+    "light": ("security/light", lambda: simulate_light_sensor(random.choice([True, False]))),
+    "smoke": ("security/smoke", simulate_smoke_sensor),
+}
+LOAD_DEFAULT_RATE = 0.2  # Messages per second per sensor, the same as the 5 second loop
+LOAD_PAYLOAD_VARIANTS = 32  # Pre-encoded payloads per sensor
+LOAD_MAX_LATENCY_SAMPLES = 100000  # Latency samples kept per process
+
+def make_template(payload, content_type):
+    """
+    Turns a payload encoded with timestamp 0 into a (payload, timestamp slots) template.
+    Slots are byte offsets for compact payloads, and the number of %-placeholders for JSON.
+    """
+    if content_type == wire_format.COMPACT_CONTENT_TYPE:
+        return payload, (wire_format.TIMESTAMP_OFFSET,)
+    if content_type == wire_format.BATCH_COMPACT_CONTENT_TYPE:
+        offsets = tuple(offset + wire_format.TIMESTAMP_OFFSET for _, offset, _ in wire_format.iter_compact_batch(payload))
+        return payload, offsets
+    template = payload.encode("utf-8").replace(b'"timestamp": 0', b'"timestamp": %.6f')
+    return template, template.count(b"%.6f")
+
+def content_type_properties(content_type):
+    """MQTT v5 properties carrying a content type, None for plain JSON."""
+    if content_type is None:
+        return None
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.ContentType = content_type
+    return properties
+
+def encode_payload_templates(simulate, payload_format="json"):
+    """
+    Pre-encodes payload variants for a sensor once.
+    Only the timestamp is filled in at publish time, see fill_timestamp().
+    Returns the templates and the content type they are published with.
+    """
+    templates = []
+    content_type = wire_format.COMPACT_CONTENT_TYPE if payload_format == "compact" else None
+    for _ in range(LOAD_PAYLOAD_VARIANTS):
+        data = simulate()
+        data["timestamp"] = 0
+        encoded, _ = encode_reading(data, payload_format)
+        templates.append(make_template(encoded, content_type))
+    return templates, content_type
+
+def encode_batch_templates(sensors, payload_format="json"):
+    """Like encode_payload_templates(), for batches holding one reading of each of the given sensors."""
+    templates = []
+    for _ in range(LOAD_PAYLOAD_VARIANTS):
+        readings = []
+        for name in sensors:
+            topic, simulate = LOAD_SENSORS[name]
+            data = simulate()
+            data["timestamp"] = 0
+            readings.append((topic, data))
+        encoded, content_type = wire_format.encode_batch(readings, payload_format)
+        templates.append(make_template(encoded, content_type))
+    return templates, content_type
+
+_COMPACT_TIMESTAMP = struct.Struct("<d")
+
+def fill_timestamp(template, timestamp):
+    """Returns a pre-encoded payload template with the timestamp filled in."""
+    payload, slots = template
+    if isinstance(slots, tuple):
+        payload = bytearray(payload)
+        for offset in slots:
+            _COMPACT_TIMESTAMP.pack_into(payload, offset, timestamp)
+        return payload
+    return payload % ((timestamp,) * slots)
+
+def load_streams(homes, rates, prefix, qos, payload_format="json", batch=False):
+    """
+    Returns the publish streams of a shard of homes as (topic, templates, interval, qos, properties).
+    Per sensor, every (home, sensor) pair is a stream at the sensor's rate. With batch, every home is
+    one stream carrying all its sensors, at the highest sensor rate.
+    A qos of None uses the per-sensor-class QoS from SENSOR_QOS.
+    """
+    streams = []
+    if batch:
+        sensors = [name for name, rate in rates.items() if rate > 0]
+        if not sensors:
+            return streams
+        templates, content_type = encode_batch_templates(sensors, payload_format)
+        properties = content_type_properties(content_type)
+        interval = 1.0 / max(rates.values())
+        batch_qos = qos if qos is not None else max(qos_for_topic(LOAD_SENSORS[name][0]) for name in sensors)
+        for home in homes:
+            streams.append((f"{prefix}/{home}/{wire_format.BATCH_TOPIC}", templates, interval, batch_qos, properties))
+        return streams
+
+    encoded = {}
+    for name, (topic, simulate) in LOAD_SENSORS.items():
+        templates, content_type = encode_payload_templates(simulate, payload_format)
+        encoded[name] = (templates, content_type_properties(content_type))
+    for home in homes:
+        for name, (topic, _) in LOAD_SENSORS.items():
+            if rates[name] > 0:
+                templates, properties = encoded[name]
+                sensor_qos = qos if qos is not None else qos_for_topic(topic)
+                streams.append((f"{prefix}/{home}/{topic}", templates, 1.0 / rates[name], sensor_qos, properties))
+    return streams
+
+def run_load_worker(homes, rates, prefix, qos, duration, payload_format="json", batch=False, topic_aliases=True):
+    """
+    Publishes for a shard of homes from one process and returns its statistics.
+    Each stream is scheduled independently at its rate, see load_streams().
+    """
+    client = mqtt.Client(protocol=mqtt.MQTTv5)
+    client.max_inflight_messages_set(1000)
+    publisher = TopicAliasPublisher(client, enabled=topic_aliases)
+    sent_at = {}  # Publish time by message id, until the broker acknowledges it
+    sent_lock = threading.RLock()  # The acknowledgement can arrive before publish() returns
+    latencies = []
+    acked = 0
+
+    def on_publish(client, userdata, mid, reason_code=None, properties=None):
+        nonlocal acked
+        now = time.perf_counter()
+        with sent_lock:
+            start = sent_at.pop(mid, None)
+        if start is not None:
+            acked += 1
+            if len(latencies) < LOAD_MAX_LATENCY_SAMPLES:
+                latencies.append(now - start)
+
+    client.on_connect = publisher.on_connect
+    client.on_publish = on_publish
+    client.connect(MQTT_BROKER, MQTT_PORT, 60)
+    client.loop_start()
+
+    # Pre-encode topics and payloads once
+    streams = load_streams(homes, rates, prefix, qos, payload_format, batch)
+    readings_per_packet = sum(1 for rate in rates.values() if rate > 0) if batch else 1
+
+    # Start every stream at a random phase so publishes are spread evenly
+    start = time.perf_counter()
+    schedule = [(start + random.random() * stream[2], i) for i, stream in enumerate(streams)]
+    heapq.heapify(schedule)
+
+    sent = 0
+    end = start + duration
+    while schedule:
+        next_time, i = schedule[0]
+        if next_time >= end:
+            break
+        now = time.perf_counter()
+        if next_time > now:
+            time.sleep(next_time - now)
+
+        topic, templates, interval, stream_qos, properties = streams[i]
+        payload = fill_timestamp(templates[sent % LOAD_PAYLOAD_VARIANTS], time.time())
+        with sent_lock:
+            published_at = time.perf_counter()
+            info = publisher.publish(topic, payload, qos=stream_qos, properties=properties)
+            if stream_qos > 0:
+                sent_at[info.mid] = published_at
+        sent += 1
+        heapq.heapreplace(schedule, (next_time + interval, i))
+
+    elapsed = time.perf_counter() - start
+    client.loop_stop()
+    client.disconnect()
+    return {
+        "sent": sent,
+        "readings": sent * readings_per_packet,
+        "bytes": publisher.sent_bytes,
+        "acked": acked,
+        "elapsed": elapsed,
+        "latencies": latencies,
+    }
+
+def run_load(homes, rates, prefix, qos, duration, processes, payload_format="json", batch=False, topic_aliases=True):
+    """Spreads the simulated homes across processes and prints the achieved publish rate, bandwidth and latency."""
+    shards = [list(range(i, homes, processes)) for i in range(processes)]
+    args = [(shard, rates, prefix, qos, duration, payload_format, batch, topic_aliases) for shard in shards if shard]
+    if batch:
+        expected = homes * max(rates.values()) * sum(1 for rate in rates.values() if rate > 0)
+    else:
+        expected = homes * sum(rates.values())
+    print(f"Simulating {homes} homes on {len(args)} processes, target {expected:.0f} readings/sec for {duration}s")
+
+    with multiprocessing.Pool(len(args)) as pool:
+        results = pool.starmap(run_load_worker, args)
+
+    sent = sum(r["sent"] for r in results)
+    readings = sum(r["readings"] for r in results)
+    sent_bytes = sum(r["bytes"] for r in results)
+    acked = sum(r["acked"] for r in results)
+    elapsed = max(r["elapsed"] for r in results)
+    latencies = sorted(latency for r in results for latency in r["latencies"])
+
+    print(f"Published {sent} packets carrying {readings} readings ({acked} acknowledged) in {elapsed:.1f}s")
+    print(f"Throughput: {sent / elapsed:.0f} packets/sec, {readings / elapsed:.0f} readings/sec, "
+          f"{sent_bytes / elapsed / 1024:.1f} KiB/sec of topics and payloads ({sent_bytes / max(readings, 1):.1f} bytes/reading)")
+    if latencies:
+        p50, p95, p99 = (percentile(latencies, f) * 1000 for f in (0.50, 0.95, 0.99))
+        print(f"Publish latency (QoS 1 messages): p50 {p50:.2f} ms, p95 {p95:.2f} ms, p99 {p99:.2f} ms, max {latencies[-1] * 1000:.2f} ms")
+
+def parse_rates(values):
+    """Parses repeated --rate SENSOR=PER_SECOND options on top of the default rate."""
+    rates = {name: LOAD_DEFAULT_RATE for name in LOAD_SENSORS}
+    for value in values or []:
+        name, _, rate = value.partition("=")
+        if name not in rates:
+            raise argparse.ArgumentTypeError(f"Unknown sensor {name!r}, expected one of {', '.join(rates)}")
+        rates[name] = float(rate)
+    return rates
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Simulate smart home sensors over MQTT.")
+    arg_parser.add_argument("--publish-all", action="store_true",
+                            help="Publish every reading every cycle instead of only changes and heartbeats")
+    arg_parser.add_argument("--format", choices=PAYLOAD_FORMATS, default="json",
+                            help="Payload encoding, compact is the binary format from wire_format.py")
+    arg_parser.add_argument("--batch", action="store_true",
+                            help="Pack the readings of each cycle into one message on <home prefix>/batch")
+    arg_parser.add_argument("--no-topic-aliases", action="store_true",
+                            help="Always send full topics instead of MQTT v5 topic aliases")
+    arg_parser.add_argument("--load", action="store_true",
+                            help="Load-generation mode: simulate many homes without per-message output")
+    arg_parser.add_argument("--homes", type=int, default=1000, help="Homes to simulate in load mode")
+    arg_parser.add_argument("--rate", action="append", metavar="SENSOR=PER_SECOND",
+                            help=f"Messages per second per sensor in load mode (default {LOAD_DEFAULT_RATE}), "
+                                 f"sensors: {', '.join(LOAD_SENSORS)}")
+    arg_parser.add_argument("--prefix", default="home",
+                            help="Topic prefix in load mode, topics are <prefix>/<home>/<sensor topic>")
+    arg_parser.add_argument("--qos", type=int, choices=[0, 1],
+                            help="QoS used for every message in load mode (default: per sensor class, see SENSOR_QOS)")
+    arg_parser.add_argument("--duration", type=float, default=60, help="Seconds to run in load mode")
+    arg_parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(),
+                            help="Publishing processes in load mode")
+    args = arg_parser.parse_args()
+
+    if args.load:
+        rates = parse_rates(args.rate)
+        run_load(args.homes, rates, args.prefix, args.qos, args.duration, args.processes, args.format,
+                 batch=args.batch, topic_aliases=not args.no_topic_aliases)
+    else:
+        client = connect_client(topic_aliases=not args.no_topic_aliases)
+        run_simulator(client, publish_all=args.publish_all, payload_format=args.format, batch=args.batch)
+
+if __name__ == "__main__":
+    main()
@@ -28,6 +28,10 @@ import {
   ReferenceLine
 } from "recharts";
 
+const STREAM_URL = "http://localhost:5000/stream"; // Server-Sent Events with live rollup deltas
+const POLL_INTERVAL = 30000; // Milliseconds between reloads while the stream is unavailable
+const MOTION_TOPIC = "home/security/door/motion";
+
 const MotionChart = () => {
   const [motionData, setMotionData] = useState([]);
   const [historicalData, setHistoricalData] = useState([]);
@@ -35,10 +39,71 @@ const MotionChart = () => {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
 
+  // Fold hourly rollup deltas of the motion topic into the loaded data, as the endpoints would compute it
+  // Buckets are UTC hours formatted as "YYYY-MM-DDTHH:00:00"
+  const applyMotionDeltas = (deltas) => {
+    setMotionData((prevData) => {
+      const days = prevData.map((day) => ({ ...day, motion_data: [...day.motion_data] }));
+      deltas.forEach((delta) => {
+        const date = delta.bucket.slice(0, 10);
+        let day = days.find((d) => d.date === date);
+        if (!day && days.length && date > days[days.length - 1].date) {
+          // A new day started, the 7 day window moves on
+          day = { date, motion_data: Array(24).fill(0) };
+          days.push(day);
+          days.shift();
+        }
+        if (day) {
+          day.motion_data[Number(delta.bucket.slice(11, 13))] = 1;
+        }
+      });
+      return days;
+    });
+
+    setHistoricalData((prevData) => {
+      const totals = Object.fromEntries(prevData.map((d) => [d.date, d.total_motions]));
+      deltas.forEach((delta) => {
+        const date = delta.bucket.slice(0, 10);
+        totals[date] = (totals[date] || 0) + delta.motion_hits;
+      });
+      return Object.keys(totals).sort().map((date) => ({ date, total_motions: totals[date] }));
+    });
+
+    setInsightData((prevData) => {
+      if (!prevData || !prevData.hourly_motion_counts) {
+        return prevData;
+      }
+      const daily = { ...prevData.daily_motion_counts };
+      const hourly = [...prevData.hourly_motion_counts];
+      let total = prevData.total_motion_detections;
+      deltas.forEach((delta) => {
+        const date = delta.bucket.slice(0, 10);
+        daily[date] = (daily[date] || 0) + delta.motion_hits;
+        hourly[Number(delta.bucket.slice(11, 13))] += delta.motion_hits;
+        total += delta.motion_hits;
+      });
+      const dates = Object.keys(daily).sort();
+      const maxDay = dates.reduce((a, b) => (daily[b] > daily[a] ? b : a), dates[0]);
+      const minDay = dates.reduce((a, b) => (daily[b] < daily[a] ? b : a), dates[0]);
+      const peak = Math.max(...hourly);
+      return {
+        ...prevData,
+        total_motion_detections: total,
+        daily_motion_counts: daily,
+        hourly_motion_counts: hourly,
+        peak_hours: hourly.map((count, hour) => (count === peak ? hour : null)).filter((hour) => hour !== null),
+        day_with_highest_motion: { date: maxDay, count: daily[maxDay] },
+        day_with_lowest_motion: { date: minDay, count: daily[minDay] },
+      };
+    });
+  };
+
   useEffect(() => {
-    const fetchData = async () => {
+    const fetchData = async (showLoading = true) => {
       try {
-        setLoading(true);
+        if (showLoading) {
+          setLoading(true);
+        }
         const [motionResponse, insightResponse, historicalResponse] = await Promise.all([
           fetch('http://localhost:5000/fetch-motion-data'),
           fetch('http://localhost:5000/motion-insights'),
@@ -64,6 +129,59 @@ const MotionChart = () => {
     };
 
     fetchData();
+
+    // Live updates are pushed by the backend instead of polling the endpoints above.
+    // When the stream is refused (503: too many clients, or several server workers without a change
+    // stream) the endpoints are polled instead, and the stream is tried again on every poll.
+    let events = null;
+    let pollTimer = null;
+    let connectedBefore = false;
+
+    const stopPolling = () => {
+      if (pollTimer) {
+        clearInterval(pollTimer);
+        pollTimer = null;
+      }
+    };
+
+    const openStream = () => {
+      if (events && events.readyState !== EventSource.CLOSED) {
+        return;
+      }
+      events = new EventSource(STREAM_URL);
+      events.onopen = () => {
+        // Deltas sent while the stream was disconnected are lost, reload everything after a reconnect
+        if (connectedBefore || pollTimer) {
+          fetchData(false);
+        }
+        connectedBefore = true;
+        stopPolling();
+      };
+      events.onerror = () => {
+        // EventSource reconnects by itself after network errors, but gives up on an error response
+        if (events.readyState === EventSource.CLOSED && !pollTimer) {
+          pollTimer = setInterval(() => {
+            fetchData(false);
+            openStream();
+          }, POLL_INTERVAL);
+        }
+      };
+      events.addEventListener("rollup", (event) => {
+        const deltas = JSON.parse(event.data).filter((delta) => delta.topic === MOTION_TOPIC && delta.motion_hits > 0);
+        if (deltas.length) {
+          applyMotionDeltas(deltas);
+        }
+      });
+    };
+
+    openStream();
+
+    return () => {
+      stopPolling();
+      if (events) {
+        events.close();
+      }
+    };
   }, []);
 
   // Default values for insights
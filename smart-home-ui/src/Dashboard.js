@@ -36,6 +36,66 @@ const MQTT_TOPIC_WINDOW_CAMERA_IMAGE = "home/camera/window/image"
 const MQTT_TOPIC_WINDOW_CAMERA_MOTION = "home/camera/window/motion"
 const MQTT_TOPIC_LIGHT = "home/security/light"
 const MQTT_TOPIC_SMOKE = "home/security/smoke" 
+const MQTT_TOPIC_BATCH = "home/batch"
+// Compact binary sensor payloads, see wire_format.py
+const COMPACT_CONTENT_TYPE = "application/vnd.smarthome.sensor.v1";
+const COMPACT_SENSOR_TYPES = {
+  1: "motion_detected",
+  2: "temperature",
+  3: "light_on",
+  4: "smoke_detected",
+};
+
+// Decode a compact payload to the same object the JSON format would carry
+const decodeCompactPayload = (message) => {
+  const view = new DataView(message.buffer, message.byteOffset, message.byteLength);
+  const version = view.getUint8(0);
+  if (version !== 1) {
+    throw new Error(`Unsupported compact payload version ${version}`);
+  }
+  const key = COMPACT_SENSOR_TYPES[view.getUint8(1)];
+  const timestamp = view.getFloat64(2, true);
+  const idLength = view.getUint8(10);
+  const sensor = new TextDecoder().decode(message.subarray(11, 11 + idLength));
+  const valueOffset = 11 + idLength;
+  const value = key === "temperature"
+    ? view.getInt16(valueOffset, true) / 100
+    : view.getUint8(valueOffset) === 1;
+  return { sensor, [key]: value, timestamp };
+};
+
+// Several readings of one home in a single message on <home prefix>/batch, see wire_format.py
+const BATCH_JSON_CONTENT_TYPE = "application/vnd.smarthome.batch+json";
+const BATCH_COMPACT_CONTENT_TYPE = "application/vnd.smarthome.batch.v1";
+
+// Split a batch into { topic, payload } readings, topics are relative to the home prefix
+const decodeBatchPayload = (message, contentType) => {
+  if (contentType === BATCH_JSON_CONTENT_TYPE) {
+    return JSON.parse(message.toString()).readings;
+  }
+  const view = new DataView(message.buffer, message.byteOffset, message.byteLength);
+  const version = view.getUint8(0);
+  if (version !== 1) {
+    throw new Error(`Unsupported compact batch version ${version}`);
+  }
+  const readings = [];
+  let offset = 2;
+  for (let i = 0; i < view.getUint8(1); i++) {
+    const topicLength = view.getUint8(offset);
+    const topic = new TextDecoder().decode(message.subarray(offset + 1, offset + 1 + topicLength));
+    offset += 1 + topicLength;
+    const recordLength = view.getUint16(offset, true);
+    offset += 2;
+    readings.push({ topic, payload: decodeCompactPayload(message.subarray(offset, offset + recordLength)) });
+    offset += recordLength;
+  }
+  return readings;
+};
+
+const SAVE_TO_BACKEND = true; // Set to false when mqtt-ingest.py is storing messages
+const BACKEND_BULK_URL = "http://localhost:5000/save-mqtt-data/bulk";
+const SAVE_FLUSH_INTERVAL = 1000; // Send buffered messages to the backend every second
+const SAVE_MAX_BATCH = 500; // Flush early once this many messages are waiting
 
 const App = () => {
   const [doorMotionDetected, setDoorMotionDetected] = useState(false);
@@ -52,9 +112,32 @@ const App = () => {
   const [smokeDetected, setSmokeDetected] = useState(false);
   const doorCameraTimeoutId = useRef(null);
   const windowCameraTimeoutId = useRef(null);
+  const pendingMessages = useRef([]);
 
   useEffect(() => {
-    const client = mqtt.connect(MQTT_BROKER);
+    // MQTT v5 is needed to receive the content type and user properties of camera frames
+    const client = mqtt.connect(MQTT_BROKER, { protocolVersion: 5 });
+
+    // Send buffered messages to the backend in one bulk request
+    const flushMessages = async () => {
+      if (pendingMessages.current.length === 0) {
+        return;
+      }
+      const batch = pendingMessages.current;
+      pendingMessages.current = [];
+
+      try {
+        await axios.post(BACKEND_BULK_URL, batch);
+      } catch (err) {
+        if (err.response && err.response.status === 429) {
+          // Backend is applying backpressure, keep the batch for the next flush
+          pendingMessages.current = batch.concat(pendingMessages.current);
+        } else {
+          console.error("Error sending data to backend:", err);
+        }
+      }
+    };
+    const flushTimer = setInterval(flushMessages, SAVE_FLUSH_INTERVAL);
 
     client.on("connect", () => {
       console.log("Connected to MQTT Broker!");
@@ -70,24 +153,22 @@ const App = () => {
         MQTT_TOPIC_WINDOW_CAMERA_MOTION,
         MQTT_TOPIC_LIGHT,
         MQTT_TOPIC_SMOKE,
-      ]);
+        MQTT_TOPIC_BATCH,
+      ], { qos: 1 }); // Delivery uses the lower of the publish and subscription QoS, keep QoS 1 sensors at QoS 1
     });
 
-    client.on("message", async (topic, message) => {
-
-      const parsedMessage = message.toString();
-      const data = { topic, payload: parsedMessage, timestamp: new Date().toISOString() };
-
-      try {
-        // Send data to the Python server
-        await axios.post("http://localhost:5000/save-mqtt-data", data);
-        console.log("Data sent to backend:", data);
-      } catch (err) {
-        console.error("Error sending data to backend:", err);
+    // Queue data for the Python server, it is sent in bulk by flushMessages
+    const saveMessage = (data) => {
+      pendingMessages.current.push(data);
+      if (pendingMessages.current.length >= SAVE_MAX_BATCH) {
+        flushMessages();
       }
+    };
 
+    // Update the dashboard state from one reading
+    const handleMessage = (topic, parsedMessage, isImage) => {
       if (topic === MQTT_TOPIC_DOOR_MOTION) {
-        const motionData = JSON.parse(message.toString());
+        const motionData = JSON.parse(parsedMessage);
         const doorMotionDetected = motionData.motion_detected;
         setDoorMotionDetected(doorMotionDetected);
 
@@ -106,7 +187,7 @@ const App = () => {
       // } 
 
       if (topic === MQTT_TOPIC_WINDOW_MOTION) {
-        const motionData = JSON.parse(message.toString());
+        const motionData = JSON.parse(parsedMessage);
         const windowMotionDetected = motionData.motion_detected;
         setWindowMotionDetected(windowMotionDetected);
 
@@ -115,7 +196,7 @@ const App = () => {
       }
 
       else if (topic === MQTT_TOPIC_TEMPERATURE) {
-        const tempData = JSON.parse(message.toString());
+        const tempData = JSON.parse(parsedMessage);
         setTemperature(tempData.temperature);
       
         // Update temperature data for the chart
@@ -134,10 +215,8 @@ const App = () => {
           return newData;
         });
       } else if (topic === MQTT_TOPIC_DOOR_CAMERA_IMAGE) {
-        const imageData = JSON.parse(message.toString());
-
-        // Extract the image data
-        const base64Image = imageData.image;
+        // Binary frames are base64 encoded once for the <img> tag, older senders wrap them in JSON
+        const base64Image = isImage ? parsedMessage : JSON.parse(parsedMessage).image;
 
         setDoorCameraImage(base64Image);
         setShowDoorImage(true); // Show the image immediately when it arrives
@@ -152,10 +231,8 @@ const App = () => {
           setShowDoorImage(false);
         }, 5000);
       } else if (topic === MQTT_TOPIC_WINDOW_CAMERA_IMAGE) {
-        const imageData = JSON.parse(message.toString());
-
-        // Extract the image data
-        const base64Image = imageData.image;
+        // Binary frames are base64 encoded once for the <img> tag, older senders wrap them in JSON
+        const base64Image = isImage ? parsedMessage : JSON.parse(parsedMessage).image;
 
         setWindowCameraImage(base64Image);
         setShowWindowImage(true); // Show the image immediately when it arrives
@@ -171,13 +248,59 @@ const App = () => {
         }, 5000);
       } else if (topic === MQTT_TOPIC_LIGHT) {
         // Handle light sensor data
-        setLightOn(JSON.parse(message.toString()).light_on); // Update light state
+        setLightOn(JSON.parse(parsedMessage).light_on); // Update light state
       } else if (topic === MQTT_TOPIC_SMOKE) {
-        setSmokeDetected(JSON.parse(message.toString()).smoke_detected);
+        setSmokeDetected(JSON.parse(parsedMessage).smoke_detected);
+      }
+    };
+
+    client.on("message", async (topic, message, packet) => {
+
+      // Camera frames are published as raw binary payloads with an image content type
+      const properties = (packet && packet.properties) || {};
+      const isImage = (properties.contentType || "").startsWith("image/");
+      const isCompact = properties.contentType === COMPACT_CONTENT_TYPE;
+      // Retained messages replayed on connect were already stored when first published
+      const save = SAVE_TO_BACKEND && !(packet && packet.retain);
+
+      // Batches are split into their readings, each handled as if it had its own topic
+      if (properties.contentType === BATCH_JSON_CONTENT_TYPE || properties.contentType === BATCH_COMPACT_CONTENT_TYPE) {
+        const home = topic.slice(0, topic.lastIndexOf("/"));
+        for (const reading of decodeBatchPayload(message, properties.contentType)) {
+          const readingTopic = `${home}/${reading.topic}`;
+          const readingMessage = JSON.stringify(reading.payload);
+          if (save) {
+            saveMessage({ topic: readingTopic, payload: readingMessage, timestamp: new Date().toISOString() });
+          }
+          handleMessage(readingTopic, readingMessage, false);
+        }
+        return;
+      }
+
+      // Compact readings are turned back into JSON once, so handleMessage works unchanged
+      let parsedMessage;
+      if (isImage) {
+        parsedMessage = message.toString("base64");
+      } else if (isCompact) {
+        parsedMessage = JSON.stringify(decodeCompactPayload(message));
+      } else {
+        parsedMessage = message.toString();
+      }
+      const data = { topic, payload: parsedMessage, timestamp: new Date().toISOString() };
+      if (isImage) {
+        data.content_type = properties.contentType;
+        data.sensor = (properties.userProperties || {}).sensor;
+      }
+
+      if (save) {
+        saveMessage(data);
       }
+      handleMessage(topic, parsedMessage, isImage);
     });
 
     return () => {
+      clearInterval(flushTimer);
+      flushMessages();
       client.end(true, () => {
         console.log("Disconnected from MQTT Broker");
       });
@@ -0,0 +1,9 @@
+"""Helpers shared by the load and benchmark scripts (loadtest.py, sensors.py, benchmark.py)."""
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
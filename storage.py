@@ -0,0 +1,442 @@
+"""
+Storage schema shared by mongodb-server.py, mqtt-ingest.py and migrate-storage.py.
+
+Messages in the mqttMessages collection are stored as:
+    {
+        "topic": <string>,          # MQTT topic, e.g. "home/security/door/motion"
+        "sensor": <string | None>,  # Sensor id from the payload, e.g. "motion_sensor_1"
+        "ts": <datetime>,           # Time the message was received, as a BSON date (UTC)
+        "payload": <document | value | string>  # Parsed JSON payload, raw string if not JSON
+    }
+
+Camera frames are not stored in the message documents. The image bytes go to the `images`
+GridFS bucket, keyed by their SHA-256 digest so identical frames are stored once, and the
+payload only keeps a reference: {"sensor", "timestamp", "image_ref", "content_type", "size"}.
+Frames no message references any more are deleted by ImageStore.expire().
+
+Hourly and daily statistics are kept in the rollupsHourly and rollupsDaily collections:
+    {
+        "topic": <string>, "sensor": <string | None>,
+        "bucket": <datetime>,  # Start of the hour or day (UTC)
+        "count": <int>,        # Messages received
+        "motion_hits": <int>,  # Messages with motion_detected true
+        "temp_count": <int>, "temp_sum": <float>, "temp_min": <float>, "temp_max": <float>
+    }
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+
+from bson.errors import InvalidDocument
+from dateutil import parser
+import bson
+import gridfs
+from gridfs.errors import FileExists
+from pymongo import ASCENDING, UpdateOne, ReplaceOne
+from pymongo.errors import OperationFailure
+
+DATABASE_NAME = os.getenv("DATABASE_NAME", "iotdata")
+COLLECTION_NAME = "mqttMessages"
+HOURLY_ROLLUP_NAME = "rollupsHourly"
+DAILY_ROLLUP_NAME = "rollupsDaily"
+IMAGE_BUCKET_NAME = "images"
+MOTION_TOPIC = "home/security/door/motion"
+
+# Retention, in days (0 keeps data forever)
+# Raw messages are only needed for recent history, the rollups back the analytics endpoints
+RAW_RETENTION_DAYS = int(os.getenv("RAW_RETENTION_DAYS", "30"))
+HOURLY_ROLLUP_RETENTION_DAYS = int(os.getenv("HOURLY_ROLLUP_RETENTION_DAYS", "90"))
+DAILY_ROLLUP_RETENTION_DAYS = int(os.getenv("DAILY_ROLLUP_RETENTION_DAYS", "730"))
+# Camera frames are kept while a stored message references them, and at least this long after upload
+IMAGE_RETENTION_DAYS = int(os.getenv("IMAGE_RETENTION_DAYS", str(RAW_RETENTION_DAYS)))
+IMAGE_SWEEP_INTERVAL = 3600  # Seconds between sweeps for unreferenced frames
+
+# Store raw messages in a MongoDB time-series collection (MongoDB 6.0+, for the secondary indexes)
+# Only applies when the collection is created, existing collections are left as they are
+TIMESERIES_COLLECTION = os.getenv("TIMESERIES_COLLECTION", "false").lower() in ("1", "true", "yes")
+
+
+def parse_timestamp(value):
+    """
+    Convert an ISO string, a Unix timestamp or a datetime to a naive UTC datetime.
+    Returns the current time when value is None, raises TypeError for any other type.
+    """
+    if value is None:
+        return datetime.utcnow()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.utcfromtimestamp(value)
+    if isinstance(value, str):
+        value = parser.isoparse(value)
+    elif not isinstance(value, datetime):
+        raise TypeError(f"Unsupported timestamp type {type(value).__name__}")
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def parse_payload(payload):
+    """Parse a JSON payload (string or bytes). Payloads that are not JSON are kept as strings."""
+    if isinstance(payload, bytes):
+        payload = payload.decode("utf-8")
+    if isinstance(payload, str):
+        try:
+            return json.loads(payload)
+        except ValueError:
+            return payload
+    return payload
+
+
+def normalize_message(topic, payload, timestamp=None, images=None):
+    """
+    Build a typed mqttMessages document from a raw MQTT message.
+    With an ImageStore, base64 images embedded in JSON payloads are moved to the store.
+    """
+    payload = parse_payload(payload)
+    if images is not None and isinstance(payload, dict) and isinstance(payload.get("image"), str):
+        image = base64.b64decode(payload.pop("image"))
+        payload.update(images.reference(image))
+    doc = {
+        "topic": topic,
+        "sensor": payload.get("sensor") if isinstance(payload, dict) else None,
+        "ts": parse_timestamp(timestamp),
+        "payload": payload,
+    }
+    check_encodable(doc)
+    return doc
+
+
+def check_encodable(doc):
+    """
+    Raise ValueError if MongoDB cannot store `doc`, e.g. for integers beyond 8 bytes.
+    Such messages are rejected when they arrive instead of failing the write of a whole batch.
+    """
+    try:
+        bson.encode(doc)
+    except (InvalidDocument, OverflowError) as e:
+        raise ValueError(f"Message cannot be stored: {e}")
+
+
+def normalize_image(topic, image, images, timestamp=None, sensor=None, sent_at=None, content_type="image/jpeg"):
+    """Store a binary camera frame in the ImageStore and build the message document referencing it."""
+    payload = {"sensor": sensor, "timestamp": sent_at, **images.reference(image, content_type)}
+    return {
+        "topic": topic,
+        "sensor": sensor,
+        "ts": parse_timestamp(timestamp),
+        "payload": payload,
+    }
+
+
+class ImageStore:
+    """
+    Content-addressed image storage on GridFS.
+    Files are keyed by the SHA-256 digest of their bytes, so a frame that was already
+    stored costs one hash and no write.
+    Frames are shared by messages, so they cannot expire with a TTL index. Instead every put()
+    refreshes the frame's metadata.last_referenced, and expire() deletes the frames that were not
+    referenced for a while and that no stored message references any more.
+    """
+
+    def __init__(self, db, prefix="", cache_size=1024, cache_max_age=3600):
+        self.fs = gridfs.GridFS(db, collection=prefix + IMAGE_BUCKET_NAME)
+        self.files = db[prefix + IMAGE_BUCKET_NAME + ".files"]
+        self.chunks = db[prefix + IMAGE_BUCKET_NAME + ".chunks"]
+        self.cache_size = cache_size
+        # Recently stored digests, skips the round trip. Entries are trusted for at most cache_max_age
+        # seconds, so last_referenced lags by at most that much and a frame expired meanwhile is stored again
+        self.cache_max_age = cache_max_age
+        self._known = OrderedDict()  # Digest -> monotonic time last_referenced was refreshed
+        self._lock = threading.Lock()
+
+    def put(self, image, content_type="image/jpeg"):
+        """Store image bytes if they are not stored yet and return their digest."""
+        digest = hashlib.sha256(image).hexdigest()
+        with self._lock:
+            known_at = self._known.get(digest)
+            if known_at is not None and time.monotonic() - known_at < self.cache_max_age:
+                self._known.move_to_end(digest)
+                return digest
+
+        now = datetime.utcnow()
+        refreshed = self.files.update_one({"_id": digest}, {"$set": {"metadata.last_referenced": now}})
+        if not refreshed.matched_count:
+            try:
+                self.fs.put(image, _id=digest, content_type=content_type, metadata={"last_referenced": now})
+            except FileExists:
+                pass  # Stored concurrently by another writer
+
+        with self._lock:
+            self._known[digest] = time.monotonic()
+            self._known.move_to_end(digest)
+            if len(self._known) > self.cache_size:
+                self._known.popitem(last=False)
+        return digest
+
+    def reference(self, image, content_type="image/jpeg"):
+        """Store image bytes and return the fields that reference them from a message payload."""
+        return {
+            "image_ref": self.put(image, content_type),
+            "content_type": content_type,
+            "size": len(image),
+        }
+
+    def get(self, digest):
+        """Return a GridOut for the image, or None if it does not exist."""
+        try:
+            return self.fs.get(digest)
+        except gridfs.errors.NoFile:
+            return None
+
+    def expire(self, collection, days=IMAGE_RETENTION_DAYS):
+        """
+        Delete the frames not referenced by a put() for `days` that no message in `collection`
+        references, with their chunks. Returns the number of deleted frames.
+        """
+        if not days:
+            return 0
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        unreferenced = {"$or": [
+            {"metadata.last_referenced": {"$lt": cutoff}},
+            {"metadata.last_referenced": {"$exists": False}, "uploadDate": {"$lt": cutoff}},  # Stored before last_referenced
+        ]}
+        deleted = 0
+        for file in self.files.find(unreferenced, {"_id": 1}):
+            digest = file["_id"]
+            if collection.find_one({"payload.image_ref": digest}, {"_id": 1}) is not None:
+                continue
+            # The filter is checked again, a put() may have referenced the frame in the meantime
+            if self.files.delete_one({"_id": digest, **unreferenced}).deleted_count:
+                self.chunks.delete_many({"files_id": digest})
+                with self._lock:
+                    self._known.pop(digest, None)
+                deleted += 1
+        return deleted
+
+
+def run_image_expiry(images, collection, interval=IMAGE_SWEEP_INTERVAL):
+    """Thread target deleting unreferenced camera frames every `interval` seconds, see ImageStore.expire()."""
+    while True:
+        time.sleep(interval)
+        try:
+            deleted = images.expire(collection)
+            if deleted:
+                print(f"Deleted {deleted} unreferenced camera images")
+        except Exception as e:
+            print(f"Error expiring camera images: {e}")  # Retried at the next sweep
+
+
+def get_collection(db, name=COLLECTION_NAME):
+    """
+    Return the raw message collection, creating it first if needed.
+    With TIMESERIES_COLLECTION a time-series collection is created, with `ts` as time field
+    and `topic` as meta field, and retention handled by the collection itself.
+    """
+    if TIMESERIES_COLLECTION and name not in db.list_collection_names():
+        options = {"timeseries": {"timeField": "ts", "metaField": "topic", "granularity": "seconds"}}
+        if RAW_RETENTION_DAYS:
+            options["expireAfterSeconds"] = RAW_RETENTION_DAYS * 24 * 60 * 60
+        db.create_collection(name, **options)
+    return db[name]
+
+
+def is_timeseries(collection):
+    """True if `collection` is a time-series collection."""
+    return "timeseries" in collection.options()
+
+
+def ensure_ttl_index(collection, field, days, name):
+    """
+    Make documents in `collection` expire `days` after the date in `field`.
+    Creates, updates (collMod) or drops the TTL index so it always matches the configuration.
+    """
+    if not days:
+        if name in collection.index_information():
+            collection.drop_index(name)
+        return
+
+    seconds = days * 24 * 60 * 60
+    try:
+        collection.create_index([(field, ASCENDING)], name=name, expireAfterSeconds=seconds)
+    except OperationFailure:
+        # The index exists with another retention, change it in place
+        collection.database.command({
+            "collMod": collection.name,
+            "index": {"name": name, "expireAfterSeconds": seconds}
+        })
+
+
+def ensure_indexes(collection):
+    """
+    Create the indexes used by the analytics and fetch endpoints, and apply the raw retention.
+    Safe to call on every startup.
+    """
+    collection.create_index([("topic", ASCENDING), ("ts", ASCENDING)], name="topic_ts")
+    collection.create_index([("sensor", ASCENDING), ("ts", ASCENDING)], name="sensor_ts")
+
+    if is_timeseries(collection):
+        collection.database.command({
+            "collMod": collection.name,
+            "expireAfterSeconds": RAW_RETENTION_DAYS * 24 * 60 * 60 if RAW_RETENTION_DAYS else "off"
+        })
+        # _id is not indexed here, /fetch-mqtt-data pages by ts instead
+        collection.create_index([("ts", ASCENDING)], name="ts")
+        # Time-series collections do not support sparse indexes, the entries are per bucket anyway
+        collection.create_index([("payload.image_ref", ASCENDING)], name="image_ref")
+    else:
+        ensure_ttl_index(collection, "ts", RAW_RETENTION_DAYS, "ts_ttl")
+        # Camera messages only, looked up by ImageStore.expire()
+        collection.create_index([("payload.image_ref", ASCENDING)], name="image_ref", sparse=True)
+
+
+def motion_pipeline(start_date, end_date, group, detections_only=True):
+    """
+    Build an aggregation pipeline over door motion messages between start_date and end_date.
+    Each message is reduced to its timestamp `ts` and a `motion` flag before being grouped with `group`.
+    With detections_only, messages without motion are filtered out before grouping.
+    """
+    match = {"topic": MOTION_TOPIC, "ts": {"$gte": start_date, "$lte": end_date}}
+    if detections_only:
+        match["payload.motion_detected"] = True
+
+    return [
+        {"$match": match},
+        {"$project": {"_id": 0, "ts": 1, "motion": {"$eq": ["$payload.motion_detected", True]}}},
+        {"$group": group}
+    ]
+
+
+def hour_bucket(ts):
+    """Start of the hour containing ts."""
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(ts):
+    """Start of the day containing ts."""
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_deltas(docs, bucket_of):
+    """
+    Combine messages into per-bucket statistics, keyed by (topic, sensor, bucket).
+    Each value holds the message count, the motion hits and the temperature readings.
+    """
+    buckets = {}
+    for doc in docs:
+        key = (doc["topic"], doc.get("sensor"), bucket_of(doc["ts"]))
+        stats = buckets.setdefault(key, {"count": 0, "motion_hits": 0, "temps": []})
+        stats["count"] += 1
+        payload = doc["payload"]
+        if isinstance(payload, dict):
+            if payload.get("motion_detected") is True:
+                stats["motion_hits"] += 1
+            temperature = payload.get("temperature")
+            if isinstance(temperature, (int, float)) and not isinstance(temperature, bool):
+                stats["temps"].append(temperature)
+    return buckets
+
+
+class Rollups:
+    """
+    Pre-aggregated hourly and daily statistics per topic and sensor.
+    update() is called with every batch written to the raw collection, so the
+    analytics endpoints can read a fixed number of buckets instead of raw messages.
+    """
+
+    def __init__(self, db, prefix=""):
+        self.hourly = db[prefix + HOURLY_ROLLUP_NAME]
+        self.daily = db[prefix + DAILY_ROLLUP_NAME]
+
+    def ensure_indexes(self):
+        for rollup, retention_days in ((self.hourly, HOURLY_ROLLUP_RETENTION_DAYS), (self.daily, DAILY_ROLLUP_RETENTION_DAYS)):
+            rollup.create_index(
+                [("topic", ASCENDING), ("bucket", ASCENDING), ("sensor", ASCENDING)],
+                name="topic_bucket_sensor",
+                unique=True,
+            )
+            ensure_ttl_index(rollup, "bucket", retention_days, "bucket_ttl")
+
+    def update(self, docs):
+        """Fold a batch of written messages into the rollups with one upsert per bucket."""
+        for rollup, bucket_of in ((self.hourly, hour_bucket), (self.daily, day_bucket)):
+            # Combine the batch in memory first, a batch usually touches only a few buckets
+            buckets = rollup_deltas(docs, bucket_of)
+
+            updates = []
+            for (topic, sensor, bucket), stats in buckets.items():
+                update = {"$inc": {"count": stats["count"], "motion_hits": stats["motion_hits"]}}
+                temps = stats["temps"]
+                if temps:
+                    update["$inc"]["temp_count"] = len(temps)
+                    update["$inc"]["temp_sum"] = sum(temps)
+                    update["$min"] = {"temp_min": min(temps)}
+                    update["$max"] = {"temp_max": max(temps)}
+                key = {"topic": topic, "sensor": sensor, "bucket": bucket}
+                updates.append(UpdateOne(key, update, upsert=True))
+
+            if updates:
+                rollup.bulk_write(updates, ordered=False)
+
+    def motion_profile(self, start, end):
+        """Motion hits per UTC hour of the day (24 counts) by topic, from the hourly rollups between start and end."""
+        profile = {}
+        query = {"bucket": {"$gte": start, "$lte": end}, "motion_hits": {"$gt": 0}}
+        for r in self.hourly.find(query, {"_id": 0, "topic": 1, "bucket": 1, "motion_hits": 1}):
+            profile.setdefault(r["topic"], [0] * 24)[r["bucket"].hour] += r["motion_hits"]
+        return profile
+
+    def rebuild(self, collection):
+        """
+        Recompute both rollups from the raw messages in `collection`, for the buckets they cover.
+        Older buckets are kept, they outlive the raw retention. The bucket holding the oldest message
+        may have lost messages to the raw retention, so it is only replaced by a recount that counts
+        at least as many messages.
+        Meant for backfilling after a migration, with ingest stopped.
+        """
+        oldest = collection.find_one({"ts": {"$type": "date"}}, {"_id": 0, "ts": 1}, sort=[("ts", ASCENDING)])
+        if oldest is None:
+            return
+
+        for rollup, unit, bucket_of in ((self.hourly, "hour", hour_bucket), (self.daily, "day", day_bucket)):
+            first = bucket_of(oldest["ts"])
+            pipeline = [
+                {"$match": {"ts": {"$gte": first}}},
+                {
+                    "$group": {
+                        "_id": {
+                            "topic": "$topic",
+                            "sensor": "$sensor",
+                            "bucket": {"$dateTrunc": {"date": "$ts", "unit": unit}}
+                        },
+                        "count": {"$sum": 1},
+                        "motion_hits": {"$sum": {"$cond": [{"$eq": ["$payload.motion_detected", True]}, 1, 0]}},
+                        "temp_count": {"$sum": {"$cond": [{"$isNumber": "$payload.temperature"}, 1, 0]}},
+                        "temp_sum": {"$sum": "$payload.temperature"},
+                        "temp_min": {"$min": "$payload.temperature"},
+                        "temp_max": {"$max": "$payload.temperature"}
+                    }
+                }
+            ]
+
+            rollup.delete_many({"bucket": {"$gt": first}})
+            replacements = []
+            for r in collection.aggregate(pipeline, allowDiskUse=True):
+                bucket = {"sensor": None, **r.pop("_id"), **r}
+                if not bucket["temp_count"]:
+                    for field in ("temp_count", "temp_sum", "temp_min", "temp_max"):
+                        del bucket[field]
+                key = {"topic": bucket["topic"], "sensor": bucket["sensor"], "bucket": bucket["bucket"]}
+                if bucket["bucket"] == first:
+                    stored = rollup.find_one(key, {"_id": 0, "count": 1})
+                    if stored is not None and stored.get("count", 0) > bucket["count"]:
+                        continue  # Some of the bucket's raw messages have expired
+                replacements.append(ReplaceOne(key, bucket, upsert=True))
+                if len(replacements) >= 1000:
+                    rollup.bulk_write(replacements, ordered=False)
+                    replacements = []
+            if replacements:
+                rollup.bulk_write(replacements, ordered=False)
@@ -0,0 +1,36 @@
+import os
+import sys
+from unittest import mock
+
+import mongomock
+import mongomock.gridfs
+import pymongo
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def bulk_write(self, requests, ordered=True, **kwargs):
+    """mongomock's bulk_write does not accept pymongo 4 operations, as used by storage.Rollups."""
+    for r in requests:
+        if isinstance(r, pymongo.UpdateOne):
+            self.update_one(r._filter, r._doc, upsert=r._upsert)
+        elif isinstance(r, pymongo.ReplaceOne):
+            self.replace_one(r._filter, r._doc, upsert=r._upsert)
+        elif isinstance(r, pymongo.InsertOne):
+            self.insert_one(r._doc)
+
+
+@pytest.fixture
+def mongo_client(monkeypatch):
+    """
+    An in-memory mongomock client. The mongomock gaps the storage code relies on (bulk_write,
+    Collection.options() and GridFS) are filled for the duration of the test only.
+    """
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", bulk_write)
+    monkeypatch.setattr(mongomock.collection.Collection, "options", lambda self: {}, raising=False)
+    mongomock.gridfs.enable_gridfs_integration()
+    try:
+        yield mongomock.MongoClient()
+    finally:
+        mock.patch.stopall()  # Undoes enable_gridfs_integration()
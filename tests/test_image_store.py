@@ -0,0 +1,80 @@
+"""Tests for storage.ImageStore retention and the migration of inline camera frames."""
+import base64
+import importlib.util
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from storage import ImageStore, ensure_indexes, get_collection, normalize_image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CAMERA_TOPIC = "home/security/door/camera/image"
+
+
+@pytest.fixture
+def db(mongo_client):
+    db = mongo_client["test_images"]
+    ensure_indexes(get_collection(db))
+    return db
+
+
+def age(images, days):
+    """Make every stored frame look `days` old."""
+    past = datetime.utcnow() - timedelta(days=days)
+    images.files.update_many({}, {"$set": {"uploadDate": past, "metadata.last_referenced": past}})
+
+
+def test_expire_deletes_only_old_unreferenced_frames(db):
+    images = ImageStore(db)
+    collection = get_collection(db)
+    normalize_image(CAMERA_TOPIC, b"unreferenced", images)
+    collection.insert_one(normalize_image(CAMERA_TOPIC, b"referenced", images))
+    age(images, 40)
+    normalize_image(CAMERA_TOPIC, b"recent", images)
+
+    assert images.expire(collection, days=30) == 1
+    remaining = {images.get(f["_id"]).read() for f in images.files.find()}
+    assert remaining == {b"referenced", b"recent"}
+    assert db["images.chunks"].count_documents({}) == 2
+
+
+def test_put_of_a_stored_frame_keeps_it_from_expiring(db):
+    collection = get_collection(db)
+    writer = ImageStore(db)
+    digest = writer.put(b"frame")
+    age(writer, 40)
+
+    # Another process stores the same frame again, its message is not written yet
+    ImageStore(db).put(b"frame")
+
+    assert writer.expire(collection, days=30) == 0
+    assert writer.get(digest).read() == b"frame"
+
+
+def test_expired_frames_are_stored_again(db):
+    images = ImageStore(db, cache_max_age=0)
+    digest = images.put(b"frame")
+    age(images, 40)
+    assert images.expire(get_collection(db), days=30) == 1
+
+    assert images.put(b"frame") == digest
+    assert images.get(digest).read() == b"frame"
+
+
+def test_migration_moves_inline_frames_to_the_image_store(db):
+    spec = importlib.util.spec_from_file_location("migrate_storage", os.path.join(ROOT, "migrate-storage.py"))
+    migrate_storage = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migrate_storage)
+
+    collection = get_collection(db)
+    payload = {"sensor": "camera_1", "image": base64.b64encode(b"legacy frame").decode("ascii")}
+    collection.insert_one({"topic": CAMERA_TOPIC, "payload": json.dumps(payload), "timestamp": datetime.utcnow().isoformat()})
+
+    images = ImageStore(db)
+    assert migrate_storage.migrate(collection, 10, images) == (1, 0)
+
+    doc = collection.find_one()
+    assert "image" not in doc["payload"]
+    assert images.get(doc["payload"]["image_ref"]).read() == b"legacy frame"
@@ -0,0 +1,145 @@
+"""
+Tests for mqtt-ingest.py: messages go through LocalBroker into IngestService, backed by mongomock.
+
+    pip install -r requirements-dev.txt
+    python -m pytest
+"""
+import importlib.util
+import json
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from storage import Rollups, ImageStore, ensure_indexes, get_collection
+from wire_format import COMPACT_CONTENT_TYPE, BATCH_COMPACT_CONTENT_TYPE, BATCH_JSON_CONTENT_TYPE, encode, encode_batch
+
+# mqtt-ingest.py is a script, its name is not importable
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+spec = importlib.util.spec_from_file_location("mqtt_ingest", os.path.join(ROOT, "mqtt-ingest.py"))
+mqtt_ingest = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mqtt_ingest)
+
+MOTION_TOPIC = "home/security/door/motion"
+STOP_TIMEOUT = 10  # Seconds, stop() hangs if a worker died
+
+
+@pytest.fixture
+def ingest(mongo_client):
+    db = mongo_client["test_ingest"]
+    collection = get_collection(db)
+    ensure_indexes(collection)
+    rollups = Rollups(db)
+    service = mqtt_ingest.IngestService(collection, rollups, ImageStore(db), workers=2)
+    service.start()
+    broker = mqtt_ingest.LocalBroker(service.on_message)
+    yield SimpleNamespace(db=db, collection=collection, rollups=rollups, service=service, broker=broker)
+    service.buffer.close()
+
+
+def stop(service):
+    """Stop the service, failing instead of hanging when queued messages are never marked done."""
+    thread = threading.Thread(target=service.stop, daemon=True)
+    thread.start()
+    thread.join(STOP_TIMEOUT)
+    assert not thread.is_alive(), "stop() did not return, a worker stopped processing the queue"
+
+
+def motion(detected, timestamp=1733050000.0):
+    return json.dumps({"sensor": "motion_sensor_1", "motion_detected": detected, "timestamp": timestamp}).encode("utf-8")
+
+
+def test_stores_typed_messages_and_rollups(ingest):
+    for detected in (True, True, False):
+        ingest.broker.publish(MOTION_TOPIC, motion(detected))
+    stop(ingest.service)
+
+    docs = list(ingest.collection.find({}, {"_id": 0}))
+    assert len(docs) == 3
+    assert {doc["topic"] for doc in docs} == {MOTION_TOPIC}
+    assert {doc["sensor"] for doc in docs} == {"motion_sensor_1"}
+    assert all(isinstance(doc["payload"], dict) for doc in docs)
+
+    for rollup in (ingest.rollups.hourly, ingest.rollups.daily):
+        buckets = list(rollup.find({"topic": MOTION_TOPIC}))
+        assert len(buckets) == 1
+        assert buckets[0]["count"] == 3
+        assert buckets[0]["motion_hits"] == 2
+
+
+def test_skips_retained_messages(ingest):
+    ingest.broker.publish(MOTION_TOPIC, motion(True), retain=True)
+    ingest.broker.publish(MOTION_TOPIC, motion(False))
+    stop(ingest.service)
+
+    docs = list(ingest.collection.find())
+    assert len(docs) == 1
+    assert docs[0]["payload"]["motion_detected"] is False
+
+
+def test_compact_messages(ingest):
+    reading = {"sensor": "temperature_sensor_1", "temperature": 21.5, "timestamp": 1733050000.0}
+    ingest.broker.publish("home/sensors/temperature", encode(reading),
+                          properties=SimpleNamespace(ContentType=COMPACT_CONTENT_TYPE))
+    stop(ingest.service)
+
+    doc = ingest.collection.find_one({"topic": "home/sensors/temperature"})
+    assert doc["sensor"] == "temperature_sensor_1"
+    assert doc["payload"] == reading
+
+
+@pytest.mark.parametrize("payload_format", ["json", "compact"])
+def test_batch_messages_are_split(ingest, payload_format):
+    readings = [
+        ("security/door/motion", {"sensor": "motion_sensor_1", "motion_detected": True, "timestamp": 1733050000.0}),
+        ("security/smoke", {"sensor": "smoke_sensor_1", "smoke_detected": False, "timestamp": 1733050000.0}),
+    ]
+    payload, content_type = encode_batch(readings, payload_format)
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    ingest.broker.publish("home/batch", payload, properties=SimpleNamespace(ContentType=content_type))
+    stop(ingest.service)
+
+    # Topics are relative to the home prefix of the batch topic
+    assert ingest.collection.find_one({"topic": MOTION_TOPIC})["payload"]["motion_detected"] is True
+    assert ingest.collection.find_one({"topic": "home/security/smoke"})["payload"]["smoke_detected"] is False
+    assert ingest.collection.count_documents({}) == 2
+    assert ingest.rollups.hourly.find_one({"topic": MOTION_TOPIC})["motion_hits"] == 1
+
+
+def test_stores_camera_frames_once(ingest):
+    frame = b"\xff\xd8 not really a jpeg \xff\xd9"
+    properties = SimpleNamespace(ContentType="image/jpeg", UserProperty=[("sensor", "camera_1"), ("timestamp", "1733050000.5")])
+    for _ in range(2):
+        ingest.broker.publish("home/security/door/camera/image", frame, properties=properties)
+    stop(ingest.service)
+
+    docs = list(ingest.collection.find())
+    assert len(docs) == 2
+    assert docs[0]["payload"]["image_ref"] == docs[1]["payload"]["image_ref"]
+    assert docs[0]["payload"]["sensor"] == "camera_1"
+    assert docs[0]["payload"]["timestamp"] == 1733050000.5
+    assert ingest.db["images.files"].count_documents({}) == 1
+
+
+def test_malformed_payloads_do_not_stop_ingest(ingest):
+    malformed = [
+        ("home/batch", bytes([1, 3]), BATCH_COMPACT_CONTENT_TYPE),  # Truncated compact batch
+        ("home/batch", b"{", BATCH_JSON_CONTENT_TYPE),
+        ("home/batch", b'{"readings": [{"payload": {}}]}', BATCH_JSON_CONTENT_TYPE),  # Reading without a topic
+        ("home/sensors/temperature", b"\x01", COMPACT_CONTENT_TYPE),
+        ("home/sensors/temperature", b"\x01\x09" + bytes(10), COMPACT_CONTENT_TYPE),  # Unknown sensor type
+        (MOTION_TOPIC, b"\xff\xfe", None),  # Not UTF-8
+        (MOTION_TOPIC, b'{"v": 100000000000000000000000}', None),  # Integer MongoDB cannot store
+    ]
+    # More bad messages than workers, so a worker dying on any of them would stall the queue
+    for topic, payload, content_type in malformed * 2:
+        ingest.broker.publish(topic, payload, properties=SimpleNamespace(ContentType=content_type))
+    ingest.broker.publish(MOTION_TOPIC, motion(True))
+    stop(ingest.service)
+
+    assert ingest.service.report(1)["decode_errors"] == len(malformed) * 2
+    docs = list(ingest.collection.find())
+    assert len(docs) == 1
+    assert docs[0]["payload"]["motion_detected"] is True
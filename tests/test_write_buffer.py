@@ -0,0 +1,86 @@
+"""Tests for write_buffer.py: accepted documents are written or kept, never dropped on an error."""
+import pytest
+from pymongo.errors import AutoReconnect
+
+from write_buffer import WriteBuffer
+
+
+class FlakyCollection:
+    """Wraps a collection and fails the first `failures` insert_many calls, like a lost connection."""
+
+    def __init__(self, collection, failures):
+        self.collection = collection
+        self.failures = failures
+
+    def insert_many(self, docs, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect("connection reset")
+        return self.collection.insert_many(docs, ordered=ordered)
+
+    def insert_one(self, doc):
+        return self.collection.insert_one(doc)
+
+
+@pytest.fixture
+def collection(mongo_client):
+    return mongo_client["test_write_buffer"]["mqttMessages"]
+
+
+def message(value):
+    return {"topic": "home/security/door/motion", "payload": {"v": value}}
+
+
+def test_unencodable_document_does_not_fail_its_batch(collection):
+    flushed = []
+    buffer = WriteBuffer(collection, on_flush=flushed.extend)
+    buffer.add([message(1), message(10 ** 23), message(2)])
+    buffer.close()
+
+    assert sorted(doc["payload"]["v"] for doc in collection.find()) == [1, 2]
+    assert [doc["payload"]["v"] for doc in flushed] == [1, 2]
+    assert buffer.stats()["written"] == 2
+    assert buffer.stats()["failed"] == 1
+
+
+def test_transient_errors_are_retried(collection):
+    buffer = WriteBuffer(FlakyCollection(collection, failures=2), retry_delay=0)
+    buffer.add([message(i) for i in range(3)])
+    buffer.close()
+
+    assert collection.count_documents({}) == 3
+    assert buffer.stats()["retries"] == 2
+    assert buffer.stats()["failed"] == 0
+
+
+def test_unwritten_documents_are_kept_for_the_next_flush(collection):
+    flaky = FlakyCollection(collection, failures=5)
+    buffer = WriteBuffer(flaky, max_retries=1, retry_delay=0)
+    buffer.add([message(i) for i in range(3)])
+
+    buffer.flush()
+    assert collection.count_documents({}) == 0
+    assert buffer.pending == 3
+
+    flaky.failures = 0
+    buffer.close()
+    assert collection.count_documents({}) == 3
+    assert buffer.pending == 0
+
+
+def test_documents_sent_before_a_failure_are_not_written_twice(collection):
+    class LostReply(FlakyCollection):
+        def insert_many(self, docs, ordered=True):
+            result = self.collection.insert_many(docs, ordered=ordered)
+            if self.failures:
+                self.failures -= 1
+                raise AutoReconnect("connection lost after the write")
+            return result
+
+    flushed = []
+    buffer = WriteBuffer(LostReply(collection, failures=1), retry_delay=0, on_flush=flushed.extend)
+    buffer.add([message(i) for i in range(3)])
+    buffer.close()
+
+    assert collection.count_documents({}) == 3
+    assert len(flushed) == 3
@@ -0,0 +1,176 @@
+"""
+Compact binary encoding for sensor readings.
+
+A compact payload is signalled with the MQTT v5 content type COMPACT_CONTENT_TYPE and laid out as
+(little-endian):
+    version      B    Format version, currently 1
+    sensor type  B    See SENSOR_TYPES
+    timestamp    d    Unix timestamp of the reading
+    id length    B    Length of the sensor id
+    sensor id    ...  UTF-8 sensor id, e.g. "motion_sensor_1"
+    value        ?|h  Boolean state, or temperature in hundredths of a degree
+Payloads without a content type (or with application/json) are JSON.
+
+Several readings of one home can be sent as a single batch message on `<home prefix>/batch`.
+Each reading carries its topic relative to the home prefix, e.g. "security/door/motion".
+    JSON batch (BATCH_JSON_CONTENT_TYPE):
+        {"readings": [{"topic": "security/door/motion", "payload": {...}}, ...]}
+    Compact batch (BATCH_COMPACT_CONTENT_TYPE):
+        version B, count B, then per reading:
+        topic length B, UTF-8 topic, record length H, compact record as above
+
+Run `python wire_format.py` to compare message size and encode/decode cost against JSON.
+"""
+import json
+import struct
+import timeit
+
+VERSION = 1
+COMPACT_CONTENT_TYPE = "application/vnd.smarthome.sensor.v1"
+JSON_CONTENT_TYPE = "application/json"
+BATCH_JSON_CONTENT_TYPE = "application/vnd.smarthome.batch+json"
+BATCH_COMPACT_CONTENT_TYPE = "application/vnd.smarthome.batch.v1"
+BATCH_TOPIC = "batch"  # Last topic level of batch messages
+
+HEADER = struct.Struct("<BBdB")
+TIMESTAMP_OFFSET = 2  # Byte offset of the timestamp, for encoders that patch pre-encoded payloads
+TEMPERATURE_SCALE = 100
+BATCH_HEADER = struct.Struct("<BB")
+BATCH_RECORD_LENGTH = struct.Struct("<H")
+
+# Sensor type code -> (payload key, struct format of the value)
+SENSOR_TYPES = {
+    1: ("motion_detected", "?"),
+    2: ("temperature", "h"),
+    3: ("light_on", "?"),
+    4: ("smoke_detected", "?"),
+}
+_TYPE_BY_KEY = {key: (code, struct.Struct("<" + fmt)) for code, (key, fmt) in SENSOR_TYPES.items()}
+_VALUE_STRUCTS = {code: struct.Struct("<" + fmt) for code, (_, fmt) in SENSOR_TYPES.items()}
+
+
+def encode(data):
+    """Encode a sensor reading dict, as produced by sensors.py, to the compact format."""
+    for key, (code, value_struct) in _TYPE_BY_KEY.items():
+        if key in data:
+            break
+    else:
+        raise ValueError(f"No compact encoding for reading with keys {sorted(data)}")
+
+    value = data[key]
+    if key == "temperature":
+        value = round(value * TEMPERATURE_SCALE)
+    sensor = data["sensor"].encode("utf-8")
+    return HEADER.pack(VERSION, code, data["timestamp"], len(sensor)) + sensor + value_struct.pack(value)
+
+
+def decode(payload):
+    """Decode a compact payload back to the dict sensors.py would have sent as JSON."""
+    version, code, timestamp, id_length = HEADER.unpack_from(payload)
+    if version != VERSION:
+        raise ValueError(f"Unsupported compact payload version {version}")
+    if code not in SENSOR_TYPES:
+        raise ValueError(f"Unknown sensor type {code}")
+
+    offset = HEADER.size
+    sensor = payload[offset:offset + id_length].decode("utf-8")
+    key, _ = SENSOR_TYPES[code]
+    value, = _VALUE_STRUCTS[code].unpack_from(payload, offset + id_length)
+    if key == "temperature":
+        value = value / TEMPERATURE_SCALE
+    return {"sensor": sensor, key: value, "timestamp": timestamp}
+
+
+def decode_payload(payload, content_type=None):
+    """
+    Decode a payload in either format, based on its content type.
+    JSON payloads are returned as the raw bytes/string, for storage.parse_payload to handle.
+    """
+    if content_type == COMPACT_CONTENT_TYPE:
+        return decode(payload)
+    return payload
+
+
+def is_batch(content_type):
+    """True if the content type is one of the batch formats."""
+    return content_type in (BATCH_JSON_CONTENT_TYPE, BATCH_COMPACT_CONTENT_TYPE)
+
+
+def encode_batch(readings, payload_format="json"):
+    """
+    Encode (relative topic, reading dict) pairs as one batch message.
+    Returns the payload and its content type.
+    """
+    if payload_format == "compact":
+        parts = [BATCH_HEADER.pack(VERSION, len(readings))]
+        for topic, data in readings:
+            topic = topic.encode("utf-8")
+            record = encode(data)
+            parts += [bytes([len(topic)]), topic, BATCH_RECORD_LENGTH.pack(len(record)), record]
+        return b"".join(parts), BATCH_COMPACT_CONTENT_TYPE
+
+    batch = {"readings": [{"topic": topic, "payload": data} for topic, data in readings]}
+    return json.dumps(batch), BATCH_JSON_CONTENT_TYPE
+
+
+def iter_compact_batch(payload):
+    """
+    Yield (relative topic, record offset, record length) for each reading of a compact batch.
+    Raises ValueError if the batch is truncated.
+    """
+    if len(payload) < BATCH_HEADER.size:
+        raise ValueError("Truncated compact batch header")
+    version, count = BATCH_HEADER.unpack_from(payload)
+    if version != VERSION:
+        raise ValueError(f"Unsupported compact batch version {version}")
+    offset = BATCH_HEADER.size
+    for index in range(count):
+        if offset >= len(payload):
+            raise ValueError(f"Truncated compact batch, {index} of {count} readings present")
+        topic_length = payload[offset]
+        record_start = offset + 1 + topic_length + BATCH_RECORD_LENGTH.size
+        if record_start > len(payload):
+            raise ValueError(f"Truncated compact batch at reading {index}")
+        topic = bytes(payload[offset + 1:offset + 1 + topic_length]).decode("utf-8")
+        record_length, = BATCH_RECORD_LENGTH.unpack_from(payload, record_start - BATCH_RECORD_LENGTH.size)
+        if record_start + record_length > len(payload):
+            raise ValueError(f"Truncated compact batch at reading {index}")
+        yield topic, record_start, record_length
+        offset = record_start + record_length
+
+
+def decode_batch(payload, content_type):
+    """Decode a batch message into (relative topic, reading dict) pairs."""
+    if content_type == BATCH_COMPACT_CONTENT_TYPE:
+        return [
+            (topic, decode(payload[offset:offset + length]))
+            for topic, offset, length in iter_compact_batch(payload)
+        ]
+    batch = json.loads(payload)
+    return [(reading["topic"], reading["payload"]) for reading in batch["readings"]]
+
+
+def benchmark(number=100000):
+    """Print bytes per message and encode/decode time for JSON and the compact format."""
+    readings = [
+        {"sensor": "motion_sensor_1", "motion_detected": True, "timestamp": 1733050000.123456},
+        {"sensor": "temperature_sensor_1", "temperature": 23.57, "timestamp": 1733050000.123456},
+        {"sensor": "light_sensor_1", "light_on": False, "timestamp": 1733050000.123456},
+        {"sensor": "smoke_sensor_1", "smoke_detected": False, "timestamp": 1733050000.123456},
+    ]
+    formats = {
+        "json": (lambda r: json.dumps(r).encode("utf-8"), json.loads),
+        "compact": (encode, decode),
+    }
+
+    print(f"{'Format':<10}{'Bytes/msg':>12}{'Encode (us)':>14}{'Decode (us)':>14}")
+    for name, (encoder, decoder) in formats.items():
+        encoded = [encoder(r) for r in readings]
+        size = sum(len(e) for e in encoded) / len(encoded)
+        encode_time = timeit.timeit(lambda: [encoder(r) for r in readings], number=number // len(readings))
+        decode_time = timeit.timeit(lambda: [decoder(e) for e in encoded], number=number // len(readings))
+        print(f"{name:<10}{size:>12.1f}{encode_time / number * 1e6:>14.2f}{decode_time / number * 1e6:>14.2f}")
+
+
+if __name__ == "__main__":
+    benchmark()
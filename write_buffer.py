@@ -0,0 +1,219 @@
+import os
+import threading
+import time
+
+from bson.errors import InvalidDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+DUPLICATE_KEY = 11000  # MongoDB error code
+
+
+class WriteBuffer:
+    """
+    In-process write buffer for MQTT messages.
+    Documents are collected in memory and written with insert_many(ordered=False)
+    once the batch reaches `max_batch_size` documents or the oldest document is
+    older than `max_age` seconds, whichever comes first.
+    Accepted documents are not dropped on errors: failed writes are retried `max_retries`
+    times with exponential backoff, then put back in the buffer for the next flush.
+    Only documents MongoDB rejects on their own are counted as failed.
+    """
+
+    def __init__(self, collection, max_batch_size=500, max_age=0.5, max_pending=50000, on_flush=None,
+                 max_retries=3, retry_delay=0.5):
+        self.collection = collection
+        self.max_batch_size = max_batch_size
+        self.max_age = max_age
+        self.max_pending = max_pending
+        self.on_flush = on_flush  # Called with the list of written documents after each flush
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay  # Seconds before the first retry, doubled for each further retry
+
+        self._docs = []
+        self._oldest = None  # time.monotonic() of the oldest buffered document
+        self._in_flight = 0  # Documents taken from the buffer but not written yet
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+        # Counters exposed through stats()
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+        self.flushes = 0
+
+    @property
+    def pending(self):
+        """Number of documents accepted but not yet written to MongoDB."""
+        return len(self._docs) + self._in_flight
+
+    @property
+    def saturation(self):
+        """Fill level of the buffer between 0.0 and 1.0."""
+        return min(self.pending / self.max_pending, 1.0)
+
+    def add(self, docs):
+        """
+        Queue documents for writing.
+        Returns False (and queues nothing) when the buffer is full, so callers can
+        apply backpressure to their producers.
+        """
+        if isinstance(docs, dict):
+            docs = [docs]
+        if not docs:
+            return True
+
+        self._ensure_flusher()
+        with self._cond:
+            if self.pending + len(docs) > self.max_pending:
+                self.rejected += len(docs)
+                return False
+
+            if not self._docs:
+                self._oldest = time.monotonic()
+            self._docs.extend(docs)
+            self.accepted += len(docs)
+
+            # Wake the flusher early once a full batch is waiting
+            if len(self._docs) >= self.max_batch_size:
+                self._cond.notify()
+        return True
+
+    def flush(self):
+        """Write everything currently buffered. Safe to call from any thread."""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._docs = self._docs, []
+                self._oldest = None
+                self._in_flight += len(batch)
+
+            unwritten = []
+            try:
+                for start in range(0, len(batch), self.max_batch_size):
+                    if not self._write(batch[start:start + self.max_batch_size]):
+                        unwritten = batch[start:]
+                        break
+            finally:
+                with self._cond:
+                    self._in_flight -= len(batch)
+                    if unwritten:
+                        # Back in front of the buffer, written by the next flush
+                        self._docs[:0] = unwritten
+                        if self._oldest is None:
+                            self._oldest = time.monotonic()
+
+    def close(self):
+        """Stop the background flusher and write any remaining documents."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+        self.flush()
+        if self._docs:
+            print(f"Write buffer closed with {len(self._docs)} unwritten documents")
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "saturation": round(self.saturation, 3),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "written": self.written,
+            "failed": self.failed,
+            "retries": self.retries,
+            "flushes": self.flushes,
+        }
+
+    def _write(self, chunk):
+        """Write a chunk, retrying errors such as a lost connection. Returns False if it could not be written."""
+        if not chunk:
+            return True
+        for attempt in range(self.max_retries + 1):
+            try:
+                written = self._insert(chunk)
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"Error writing batch, {len(chunk)} documents kept for the next flush: {e}")
+                    return False
+                delay = self.retry_delay * 2 ** attempt
+                print(f"Error writing batch, retrying in {delay}s: {e}")
+                self.retries += 1
+                time.sleep(delay)
+
+        self.written += len(written)
+        self.flushes += 1
+        if self.on_flush and written:
+            try:
+                self.on_flush(written)
+            except Exception as e:
+                print(f"Error in flush callback: {e}")
+        return True
+
+    def _insert(self, chunk):
+        """
+        Insert a chunk and return the written documents.
+        A duplicate _id means the document was sent by an earlier attempt that failed afterwards,
+        it is counted as written (insert_many sets the _id of the documents it is given).
+        """
+        try:
+            self.collection.insert_many(chunk, ordered=False)
+            return chunk
+        except BulkWriteError as e:
+            # With ordered=False the rest of the batch is still written
+            failed_indexes = {err["index"] for err in e.details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY}
+            if failed_indexes:
+                self.failed += len(failed_indexes)
+                print(f"Error writing batch: {len(failed_indexes)} documents failed")
+            return [doc for i, doc in enumerate(chunk) if i not in failed_indexes]
+        except (InvalidDocument, OverflowError):
+            # One document that cannot be encoded fails the whole call, write the others one by one
+            return self._insert_each(chunk)
+
+    def _insert_each(self, chunk):
+        written = []
+        for doc in chunk:
+            try:
+                self.collection.insert_one(doc)
+            except DuplicateKeyError:
+                pass  # Written by an earlier attempt
+            except (InvalidDocument, OverflowError) as e:
+                self.failed += 1
+                print(f"Error writing document on {doc.get('topic')}: {e}")
+                continue
+            written.append(doc)
+        return written
+
+    def _ensure_flusher(self):
+        # The flusher thread is started lazily and restarted after a fork,
+        # so each worker process gets its own.
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="write-buffer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if len(self._docs) >= self.max_batch_size:
+                        break
+                    if self._oldest is not None:
+                        remaining = self.max_age - (time.monotonic() - self._oldest)
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+            self.flush()
@@ -0,0 +1,16 @@
+"""
+WSGI entry point for running mongodb-server.py under a production server:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The module is loaded by path since its file name is not a valid Python identifier.
+"""
+import importlib.util
+import os
+
+_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mongodb-server.py")
+_spec = importlib.util.spec_from_file_location("mongodb_server", _path)
+server = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(server)
+
+app = server.app